@@ -55,13 +55,16 @@ setup(name='zojax.layout',
       install_requires = ['setuptools',
                           'zope.event',
                           'zope.schema',
+                          'zope.datetime',
                           'zope.component',
                           'zope.interface',
                           'zope.security',
                           'zope.publisher',
+                          'zope.contenttype',
                           'zope.configuration',
                           'zope.pagetemplate',
                           'zope.tales',
+                          'zope.i18n',
                           'zope.app.component',
                           'zope.app.publisher',
                           'zope.app.pagetemplate',
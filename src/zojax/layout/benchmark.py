@@ -0,0 +1,437 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" benchmarks of zojax.layout
+
+$Id$
+"""
+import os, gc, sys, time, shutil, tempfile, optparse
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from zope import interface, component
+from zope.interface.interface import InterfaceClass
+from zope.publisher.browser import TestRequest
+
+import zojax.layout
+from pagelet import BrowserPagelet, CompactPagelet
+from pagelet import PageletPublisher, queryLayout, queryPagelet
+from layout import Layout, CompactLayout
+from plan import layoutPlan
+
+
+class Node(object):
+    """ content object of synthetic tree """
+
+    def __init__(self, name, parent=None):
+        self.__name__ = name
+        self.__parent__ = parent
+
+
+def levelInterface(level):
+    """ interface provided by tree nodes on level, interface is
+    available as zojax.layout.benchmark.ILevel<level> """
+    name = 'ILevel%s'%level
+    iface = globals().get(name)
+    if iface is None:
+        iface = InterfaceClass(name, __module__=__name__)
+        globals()[name] = iface
+    return iface
+
+
+def buildTree(depth=5, fanout=3):
+    """ tree of nodes, node on level N provides ILevelN,
+    returns root and list of leaves """
+    root = Node(u'root')
+    interface.alsoProvides(root, levelInterface(0))
+
+    level = [root]
+    for idx in range(1, depth):
+        iface = levelInterface(idx)
+        nodes = []
+        for parent in level:
+            for n in range(fanout):
+                node = Node(u'node%s'%n, parent)
+                interface.alsoProvides(node, iface)
+                nodes.append(node)
+        level = nodes
+
+    return root, level
+
+
+def layoutLevel(idx, layouts, depth):
+    # innermost layout is registered for leaves, outermost for root
+    return (layouts - 1 - idx) * (depth - 1) // max(layouts - 1, 1)
+
+
+def pageletLevel(idx, layouts, depth):
+    # context of layout template is context of inner layout
+    if idx == 0:
+        return depth - 1
+    return layoutLevel(idx - 1, layouts, depth)
+
+
+class BenchmarkSite(object):
+    """ site of local registry with benchmark registrations """
+
+    def __init__(self, sm):
+        self.sm = sm
+
+    def getSiteManager(self):
+        return self.sm
+
+
+def setUpRegistry(depth=5, layouts=3, pagelets=10, compact=False):
+    """ register `layouts` chained layouts at varying depths and
+    `pagelets` pagelets rendered by layouts, main view is
+    'index.html' pagelet. Components are registered in local registry,
+    it is used until tearDownRegistry() is called. Returns state
+    for tearDownRegistry() """
+    from zope.component.registry import Components
+    from zope.configuration import xmlconfig
+    from zope.app.component import hooks
+    from zope.security.checker import _checkers
+    from z3c.pt import expressions as ptexpressions
+    from expressions import PageletTranslator
+
+    registry = Components(
+        'zojax.layout.benchmark', (component.getGlobalSiteManager(),))
+    registry.registerUtility(ptexpressions.path_translator, name='path')
+    registry.registerUtility(PageletTranslator(), name='pagelet')
+
+    plan = layoutPlan.__dict__.copy()
+    plan['records'] = dict(layoutPlan.records)
+
+    directory = tempfile.mkdtemp()
+    # security checkers of generated classes are defined globally
+    state = (hooks.getSite(), plan, directory, dict(_checkers))
+
+    hooks.setHooks()
+    hooks.setSite(BenchmarkSite(registry))
+    try:
+        context = xmlconfig.file('meta.zcml', zojax.layout)
+        xmlconfig.string(
+            '<configure xmlns:zojax="http://namespaces.zope.org/zojax">'
+            '%s</configure>'%'\n'.join(
+                benchmarkZCML(directory, depth, layouts, pagelets, compact)),
+            context)
+    except:
+        tearDownRegistry(state)
+        raise
+
+    return state
+
+
+def benchmarkZCML(directory, depth, layouts, pagelets, compact):
+    def write(name, text):
+        path = os.path.join(directory, name)
+        open(path, 'w').write(text)
+        return path
+
+    if compact:
+        pageletClass = ' class="zojax.layout.pagelet.CompactPagelet"'
+        layoutClass = ' class="zojax.layout.layout.CompactLayout"'
+    else:
+        pageletClass = layoutClass = ''
+
+    zcml = []
+    zcml.append(
+        '<zojax:pagelet name="index.html" for="*" layout="bench.layout0" '
+        'template="%s" permission="zope.Public"%s />'%(
+            write('index.pt', '<p tal:content="python:context.__name__" />'),
+            pageletClass))
+
+    for idx in range(layouts):
+        level = layoutLevel(idx, layouts, depth)
+        names = ['bench.pagelet%s'%n for n in range(pagelets)
+                 if n % layouts == idx]
+
+        template = ['<div>']
+        for name in names:
+            template.append(
+                '<div tal:content="structure pagelet:+%s" />'%name)
+            zcml.append(
+                '<zojax:pagelet name="%s" for="zojax.layout.benchmark.'
+                'ILevel%s" template="%s" permission="zope.Public"%s />'%(
+                    name, pageletLevel(idx, layouts, depth),
+                    write('%s.pt'%name, '<span>%s</span>'%name),
+                    pageletClass))
+        template.append(
+            '<div tal:content="structure view/render" /></div>')
+
+        if idx < layouts - 1:
+            parent = ' layout="bench.layout%s"'%(idx + 1)
+        else:
+            parent = ''
+
+        zcml.append(
+            '<zojax:layout name="bench.layout%s" for="zojax.layout.'
+            'benchmark.ILevel%s" template="%s"%s%s />'%(
+                idx, level,
+                write('layout%s.pt'%idx, '\n'.join(template)),
+                parent, layoutClass))
+
+    return zcml
+
+
+def tearDownRegistry(state):
+    """ restore site, layout plan and security checkers """
+    from zope.app.component import hooks
+    from zope.security.checker import _checkers
+
+    site, plan, directory, checkers = state
+    hooks.setSite(site)
+
+    _checkers.clear()
+    _checkers.update(checkers)
+
+    layoutPlan.__dict__.clear()
+    layoutPlan.__dict__.update(plan)
+
+    shutil.rmtree(directory, True)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = int(round(p / 100.0 * (len(values) - 1)))
+    return values[idx]
+
+
+def timeit(func, count):
+    """ calls per second """
+    t = time.time()
+    for idx in xrange(count):
+        func()
+    duration = time.time() - t
+    return duration and count / duration or 0.0
+
+
+def benchLookups(leaves, depth, layouts, pagelets, count=1000):
+    """ lookups per second of layouts and pagelets, pagelet lookups
+    include misses, PageletPublisher renders pagelet """
+    request = TestRequest()
+    leaf = leaves[-1]
+    view = component.getMultiAdapter((leaf, request), name='index.html')
+
+    contexts = []
+    context = leaf
+    while context is not None:
+        contexts.insert(0, context)
+        context = context.__parent__
+
+    def layoutLookup():
+        queryLayout(view, request, leaf, name='bench.layout0')
+
+    outer = 'bench.layout%s'%(layouts - 1)
+    def outerLayoutLookup():
+        queryLayout(view, request, leaf, name=outer)
+
+    names = ['+bench.pagelet%s'%n for n in range(pagelets)]
+    levels = [contexts[pageletLevel(n % layouts, layouts, depth)]
+              for n in range(pagelets)]
+    items = zip(levels, names)
+
+    def pageletLookup():
+        for context, name in items:
+            queryPagelet(context, request, name)
+
+    def pageletMiss():
+        for context, name in items:
+            queryPagelet(leaf, request, name + '.missing')
+
+    publisher = PageletPublisher(levels[0], request)
+    def publisherRender():
+        publisher[names[0]]
+
+    return {
+        'layout': timeit(layoutLookup, count),
+        'outerlayout': timeit(outerLayoutLookup, count),
+        'pagelet': timeit(pageletLookup, count) * len(items),
+        'pageletmiss': timeit(pageletMiss, count) * len(items),
+        'publisher': timeit(publisherRender, count)}
+
+
+def renderPage(leaf):
+    request = TestRequest()
+    view = component.getMultiAdapter((leaf, request), name='index.html')
+    return view, request, view()
+
+
+def benchRender(leaves, count=1000):
+    """ latency of full page render: main view and layouts chain,
+    in milliseconds """
+    latencies = []
+    size = 0
+    for idx in xrange(count):
+        leaf = leaves[idx % len(leaves)]
+        t = time.time()
+        view, request, result = renderPage(leaf)
+        latencies.append((time.time() - t) * 1000.0)
+        size = len(result)
+
+    return {
+        'count': count,
+        'size': size,
+        'mean': sum(latencies) / len(latencies),
+        'min': min(latencies),
+        'max': max(latencies),
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99)}
+
+
+def benchMemory(leaves, count=20):
+    """ objects and bytes retained by render: view, layouts,
+    request and output. Only objects tracked by garbage collector and
+    output are counted """
+    objects = []
+    size = []
+    for idx in xrange(count):
+        leaf = leaves[idx % len(leaves)]
+
+        gc.collect()
+        before = set(id(ob) for ob in gc.get_objects())
+
+        view, request, result = renderPage(leaf)
+
+        gc.collect()
+        # 'before' set itself is new object too
+        new = [ob for ob in gc.get_objects()
+               if id(ob) not in before and ob is not before]
+        objects.append(len(new))
+        size.append(sum([sys.getsizeof(ob) for ob in new]) +
+                    sys.getsizeof(result))
+        del new, view, request, result
+
+    return {
+        'objects': sum(objects) / float(count),
+        'bytes': sum(size) / float(count)}
+
+
+def run(depth=5, fanout=3, layouts=3, pagelets=10, count=1000,
+        compact=False):
+    """ run benchmark suite, returns dictionary that can be
+    stored as json """
+    root, leaves = buildTree(depth, fanout)
+    state = setUpRegistry(depth, layouts, pagelets, compact)
+    try:
+        # warm up caches and compile templates
+        for leaf in leaves:
+            renderPage(leaf)
+
+        return {
+            'params': {'depth': depth, 'fanout': fanout,
+                       'layouts': layouts, 'pagelets': pagelets,
+                       'count': count, 'compact': compact,
+                       'python': sys.version.split()[0]},
+            'lookups': benchLookups(leaves, depth, layouts, pagelets, count),
+            'render': benchRender(leaves, count),
+            'memory': benchMemory(leaves),
+            'instances': benchInstances(count)}
+    finally:
+        tearDownRegistry(state)
+
+
+def compare(base, result):
+    """ relative change of all numeric values of two runs,
+    1.0 is no change """
+    changes = {}
+    for key, value in result.items():
+        if key == 'params':
+            continue
+
+        other = base.get(key)
+        if isinstance(value, dict) and isinstance(other, dict):
+            changes[key] = compare(other, value)
+        elif isinstance(value, (int, float)) and \
+                isinstance(other, (int, float)) and other:
+            changes[key] = value / float(other)
+    return changes
+
+
+def instanceSize(obj):
+    """ memory used by instance and its attributes dictionary """
+    size = sys.getsizeof(obj)
+
+    d = getattr(obj, '__dict__', None)
+    if d is not None:
+        size += sys.getsizeof(d)
+
+    return size
+
+
+def benchInstances(count=10000, contexts=1):
+    """ size and creation time of regular and compact instances """
+    context = object()
+    request = TestRequest()
+    args = (context,)*(contexts + 1) + (request,)
+
+    view = CompactPagelet(context, request)
+
+    factories = (
+        ('pagelet', BrowserPagelet, args),
+        ('compactpagelet', CompactPagelet, args),
+        ('layout', Layout, (view, context, request)),
+        ('compactlayout', CompactLayout, (view, context, request)))
+
+    result = {}
+    for name, factory, args in factories:
+        t = time.time()
+        for idx in xrange(count):
+            factory(*args)
+        duration = time.time() - t
+
+        result[name] = {
+            'size': instanceSize(factory(*args)),
+            'time': duration,
+            'persec': duration and count / duration or 0.0}
+
+    return result
+
+
+def main(args=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--depth', type='int', default=5)
+    parser.add_option('--fanout', type='int', default=3)
+    parser.add_option('--layouts', type='int', default=3)
+    parser.add_option('--pagelets', type='int', default=10)
+    parser.add_option('--count', type='int', default=1000)
+    parser.add_option('--compact', action='store_true', default=False,
+                      help='use CompactPagelet and CompactLayout classes')
+    parser.add_option('--output', help='write json report to file')
+    parser.add_option('--compare', help='compare with json report')
+    options, args = parser.parse_args(args)
+
+    result = run(options.depth, options.fanout, options.layouts,
+                 options.pagelets, options.count, options.compact)
+
+    if options.compare:
+        result['compare'] = compare(
+            json.load(open(options.compare)), result)
+
+    report = json.dumps(result, indent=2, sort_keys=True)
+    if options.output:
+        open(options.output, 'w').write(report)
+    else:
+        print report
+
+
+if __name__ == '__main__':
+    # level interfaces should be importable from zojax.layout.benchmark
+    from zojax.layout.benchmark import main
+    main()
@@ -0,0 +1,158 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" lookup caches bound to component registry state
+
+$Id$
+"""
+import weakref, itertools, threading
+
+
+class LRUCache(object):
+    """ Bounded cache, least recently used items are evicted """
+
+    def __init__(self, maxsize, owner=None):
+        self.maxsize = maxsize
+        self.owner = owner
+        self._data = {}
+        self._clock = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            if self.owner is not None:
+                self.owner.misses += 1
+            return default
+
+        item[1] = self._clock.next()
+        if self.owner is not None:
+            self.owner.hits += 1
+        return item[0]
+
+    def __setitem__(self, key, value):
+        self._data[key] = [value, self._clock.next()]
+
+        if len(self._data) > self.maxsize:
+            self._evict()
+
+    def _evict(self):
+        self._lock.acquire()
+        try:
+            size = len(self._data)
+            if size <= self.maxsize:
+                return
+
+            # evict in batches, so eviction cost is amortized
+            items = [(item[1], key) for key, item in self._data.items()]
+            items.sort()
+            count = size - self.maxsize + self.maxsize // 10
+            for tick, key in items[:count]:
+                self._data.pop(key, None)
+
+            if self.owner is not None:
+                self.owner.evictions += count
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        return item[0]
+
+    def values(self):
+        return [item[0] for item in self._data.values()]
+
+    def clear(self):
+        self._data.clear()
+
+
+class RegistryCache(object):
+    """ Per registry lookup cache.
+
+    Cached data is dropped as soon as registry or any of its bases
+    is changed (registerAdapter, unregisterAdapter, bases change).
+    Additional registries can be passed to `get`, cached data
+    also depends on its state."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.clear()
+
+    def get(self, registry, *registries):
+        generation = [r._generation for r in registry.ro]
+        for reg in registries:
+            generation.extend([r._generation for r in reg.ro])
+        generation = tuple(generation)
+
+        data = self._data.get(registry)
+        if data is None or data[0] != generation:
+            data = (generation, LRUCache(self.maxsize, self))
+            self._data[registry] = data
+
+        return data[1]
+
+    def clear(self):
+        self._data = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        size = 0
+        for generation, data in self._data.values():
+            size += len(data)
+
+        total = self.hits + self.misses
+        if total:
+            ratio = float(self.hits) / total
+        else:
+            ratio = 0.0
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'ratio': ratio,
+                'evictions': self.evictions,
+                'size': size}
+
+
+# queryLayout results
+layoutCache = RegistryCache()
+
+# queryPagelet misses
+pageletMissCache = RegistryCache(5000)
+
+# pagelet types resolved by pagelet selectors
+selectorCache = RegistryCache(1000)
+
+# IPageletContext adapters and factories of pagelets with
+# additional contexts
+pageletContextCache = RegistryCache(5000)
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(layoutCache.clear)
+    addCleanUp(pageletMissCache.clear)
+    addCleanUp(selectorCache.clear)
+    addCleanUp(pageletContextCache.clear)
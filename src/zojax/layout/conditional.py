@@ -0,0 +1,155 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" conditional GET, validators of view and layouts chain
+
+$Id$
+"""
+import calendar, datetime
+from zope.datetime import rfc1123_date, time as parseDate, DateTimeError
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from zope.interface import providedBy
+from zope.i18n.interfaces import IUserPreferredLanguages
+
+import pagelet
+from interfaces import LayoutNotFound
+
+
+def layoutChain(view):
+    """ layouts used for rendering of view, layouts are bound to
+    view and inner layout like in rendering, but they are not updated """
+    layout = pagelet.queryLayout(
+        view, view.request, view.__parent__, name=view.layoutname)
+
+    kwargs = {}
+    while layout is not None:
+        yield layout
+
+        # parent of custom layout is unknown
+        if getattr(layout, '_bind', None) is None:
+            break
+
+        layoutview = layout._bind(**kwargs)
+        layout, kwargs = layout._queryParent(layoutview, layout.mainview)
+
+
+def _none():
+    return None
+
+
+def toTimestamp(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value - value.utcoffset()
+        return calendar.timegm(value.timetuple())
+    return int(value)
+
+
+def requestVariant(request):
+    """ principal, language and layers of request, page depends on them
+    even if view and layouts are not changed """
+    principal = getattr(getattr(request, 'principal', None), 'id', None)
+
+    locale = getattr(request, 'locale', None)
+    if locale is not None:
+        language = locale.getLocaleID()
+    else:
+        languages = IUserPreferredLanguages(request, None)
+        if languages is not None:
+            language = tuple(languages.getPreferredLanguages())
+        else:
+            language = None
+
+    layers = tuple([iface.__identifier__ for iface in providedBy(request)])
+    return principal, language, layers
+
+
+def hasVariant(request):
+    """ page of request depends on principal or language """
+    principal, language, layers = requestVariant(request)
+    return principal is not None or bool(language)
+
+
+def getValidators(view):
+    """ etag and last modification time of page, validators are
+    composed from view and all layouts. Returns None if view or
+    any layout doesn't support conditional requests """
+    version = getattr(view, 'validator', _none)()
+    modified = getattr(view, 'lastModified', _none)()
+    if version is None and modified is None:
+        return None
+
+    parts = [requestVariant(view.request),
+             (view.__class__.__name__, view.__name__, version)]
+    modified = modified is not None and [toTimestamp(modified)] or []
+
+    try:
+        for layout in layoutChain(view):
+            version = getattr(layout, 'validator', _none)()
+            if version is None:
+                return None
+
+            parts.append(
+                (layout.__name__, getattr(layout, 'uid', None), version))
+
+            layoutModified = getattr(layout, 'lastModified', _none)()
+            if layoutModified is not None:
+                modified.append(toTimestamp(layoutModified))
+    except LayoutNotFound:
+        return None
+
+    etag = '"%s"'%md5(repr(parts)).hexdigest()
+    return etag, modified and max(modified) or None
+
+
+def notModified(view):
+    """ set validators headers, returns True if client has fresh copy
+    of page, response status is set to 304 in this case """
+    request = view.request
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    validators = getValidators(view)
+    if validators is None:
+        return False
+
+    etag, modified = validators
+    response = request.response
+    response.setHeader('ETag', etag)
+    if modified is not None:
+        response.setHeader('Last-Modified', rfc1123_date(modified))
+
+    match = request.getHeader('If-None-Match')
+    if match:
+        match = [tag.strip() for tag in match.split(',')]
+        fresh = '*' in match or etag in match or 'W/%s'%etag in match
+    else:
+        # modification time doesn't depend on principal and language,
+        # page of authenticated or localized request is checked by etag only
+        since = request.getHeader('If-Modified-Since')
+        if not since or modified is None or hasVariant(request):
+            return False
+
+        try:
+            fresh = modified <= parseDate(since.split(';')[0])
+        except DateTimeError:
+            return False
+
+    if fresh:
+        response.setStatus(304)
+    return fresh
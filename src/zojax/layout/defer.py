@@ -0,0 +1,78 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" deferred client side loading of pagelets
+
+Pagelets registered with 'defer' attribute are rendered as placeholders,
+browser loads all deferred pagelets of page with one request
+to @@pagelet/batch.json
+
+$Id$
+"""
+import os
+from xml.sax.saxutils import quoteattr
+from zope.traversing.browser.absoluteurl import absoluteURL
+
+# loader script is rendered
+SCRIPT_KEY = 'zojax.layout.defer.script'
+
+# pagelets are rendered by batch view
+BATCH_KEY = 'zojax.layout.defer.batch'
+
+# name of batch view of PageletPublisher
+BATCH = 'batch.json'
+
+
+def _readScript():
+    f = open(os.path.join(os.path.dirname(__file__), 'deferred.js'))
+    try:
+        return f.read().decode('utf-8').strip()
+    finally:
+        f.close()
+
+# loader of deferred pagelets
+SCRIPT = u'<script type="text/javascript">%s</script>'%_readScript()
+
+
+def isDeferred(pagelet, request):
+    if not getattr(pagelet, 'defer', False):
+        return False
+
+    # pagelets are rendered by batch view
+    annotations = getattr(request, 'annotations', None)
+    if annotations is None or annotations.get(BATCH_KEY):
+        return False
+    return True
+
+
+def deferPlaceholder(context, request, name):
+    """ placeholder of deferred pagelet, loader script is rendered
+    with first placeholder of page """
+    url = '%s/@@pagelet/%s'%(absoluteURL(context, request), BATCH)
+    placeholder = u'<div class="zojax-deferred" data-pagelet=%s data-url=%s>'\
+        u'</div>'%(quoteattr(getattr(name, 'name', name)), quoteattr(url))
+
+    if request.annotations.get(SCRIPT_KEY):
+        return placeholder
+
+    request.annotations[SCRIPT_KEY] = True
+    return SCRIPT + placeholder
+
+
+def batchNames(request):
+    """ names of pagelets requested by batch view, names are passed
+    as 'pagelets:list' parameters """
+    names = request.form.get('pagelets', ())
+    if isinstance(names, basestring):
+        names = (names,)
+    return [name.strip() for name in names if name.strip()]
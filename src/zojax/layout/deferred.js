@@ -0,0 +1,27 @@
+(function() {
+function load() {
+  var nodes = document.querySelectorAll('div.zojax-deferred'), urls = {};
+  for (var i = 0; i < nodes.length; i++) {
+    var url = nodes[i].getAttribute('data-url');
+    (urls[url] = urls[url] || []).push(nodes[i]);
+  }
+  for (var url in urls) { loadBatch(url, urls[url]); }
+}
+function loadBatch(url, nodes) {
+  var names = [], xhr = new XMLHttpRequest();
+  for (var i = 0; i < nodes.length; i++)
+    names.push('pagelets:list=' +
+               encodeURIComponent(nodes[i].getAttribute('data-pagelet')));
+  xhr.open('GET', url + '?' + names.join('&'));
+  xhr.onload = function() {
+    var data = JSON.parse(xhr.responseText);
+    for (var i = 0; i < nodes.length; i++)
+      nodes[i].outerHTML = data[nodes[i].getAttribute('data-pagelet')] || '';
+  };
+  xhr.send();
+}
+if (document.readyState == 'loading')
+  document.addEventListener('DOMContentLoaded', load);
+else
+  load();
+})();
@@ -0,0 +1,51 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" edge side includes of pagelets
+
+Pagelets registered with 'esi' attribute are rendered as
+<esi:include /> placeholders if request is sent by edge cache
+with ESI support, edge cache loads pagelet from @@pagelet view.
+
+$Id$
+"""
+import re, urllib
+from xml.sax.saxutils import escape, unescape
+from zope.traversing.browser.absoluteurl import absoluteURL
+
+CAPABILITY = 'ESI/1.0'
+
+_include = re.compile(r'<esi:include\s+src="([^"]*)"\s*/>')
+
+
+def esiEnabled(request):
+    """ request is sent by edge cache that processes ESI """
+    return CAPABILITY in (request.getHeader('Surrogate-Capability') or '')
+
+
+def esiInclude(context, request, name):
+    """ ESI placeholder of pagelet """
+    url = '%s/@@pagelet/%s'%(
+        absoluteURL(context, request),
+        urllib.quote(getattr(name, 'name', name).encode('utf-8')))
+
+    request.response.setHeader('Surrogate-Control', 'content="%s"'%CAPABILITY)
+    return u'<esi:include src="%s"/>'%escape(url, {'"': '&quot;'})
+
+
+def assemble(body, fetch):
+    """ replace ESI placeholders with fragments, `fetch` is called with
+    url of fragment. Can be used as ESI processor in tests or development
+    servers """
+    return _include.sub(
+        lambda match: fetch(unescape(match.group(1), {'&quot;': '"'})), body)
@@ -19,7 +19,13 @@ import re
 from chameleon.core import types
 from chameleon.zpt import expressions
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 from tales import PageletExpression
+from pagelet import getPageletSelector
 
 
 class PageletTraverser(PageletExpression):
@@ -27,13 +33,27 @@ class PageletTraverser(PageletExpression):
     __call__ = PageletExpression.render
 
 
+class BoundPageletTraverser(PageletExpression):
+    """ pagelet traverser with pagelet selector resolved
+    at template compile time """
+
+    def __init__(self, selector):
+        self.selector = selector
+
+    def __call__(self, context, request, view):
+        return self.render(context, request, view, self.selector)
+
+
 class PageletTranslator(expressions.ExpressionTranslator):
 
     symbol = '_get_zojax_pagelet'
     pagelet_traverser = PageletTraverser()
 
     def translate(self, string, escape=None):
-        value = types.value("%s(context, request, view, '%s')" % \
-                                (self.symbol, string))
-        value.symbol_mapping[self.symbol] = self.pagelet_traverser
+        selector = getPageletSelector(string)
+        symbol = '%s_%s'%(
+            self.symbol, md5(string.encode('utf-8')).hexdigest())
+
+        value = types.value("%s(context, request, view)" % symbol)
+        value.symbol_mapping[symbol] = BoundPageletTraverser(selector)
         return value
@@ -0,0 +1,149 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" asynchronous pagelet updates
+
+Pagelet can start slow operations in `updateAsync` method, it returns
+future or list of futures. Futures of all pagelets of page are gathered
+before templates are rendered, so `update` and `render` don't wait.
+
+$Id$
+"""
+import time, logging
+
+import pagelet, conditional
+from interfaces import LayoutNotFound
+from workers import Future, submit
+
+ANNOTATION_KEY = 'zojax.layout.gather'
+
+# time in seconds to wait for pending updates
+waittimeout = 5.0
+
+
+def _getState(request):
+    annotations = getattr(request, 'annotations', None)
+    if annotations is None:
+        return None
+    return annotations.setdefault(
+        ANNOTATION_KEY, {'pending': [], 'pagelets': {}})
+
+
+def addPending(request, futures):
+    """ add futures that should be done before rendering """
+    state = _getState(request)
+    if state is None or futures is None:
+        return
+
+    if isinstance(futures, (list, tuple)):
+        state['pending'].extend(futures)
+    else:
+        state['pending'].append(futures)
+
+
+def startUpdates(context, request, names):
+    """ query pagelets and start asynchronous updates, pagelets are
+    used later by 'pagelet:' expressions """
+    state = _getState(request)
+    if state is None or not names:
+        return
+
+    pagelets = state['pagelets']
+    for name in names:
+        key = (id(context), name)
+        if key in pagelets:
+            continue
+
+        try:
+            view = pagelet.queryPagelet(context, request, name)
+            if view is None:
+                continue
+
+            updateAsync = getattr(view, 'updateAsync', None)
+            if updateAsync is not None:
+                addPending(request, updateAsync())
+        except Exception, err:
+            logging.getLogger('zojax.layout').exception(err)
+            continue
+
+        pagelets[key] = (context, view)
+
+
+def startViewUpdates(view, futures):
+    """ asynchronous updates of main view and pagelets of all layouts
+    are started before main view is updated, then all are gathered """
+    request = view.request
+    addPending(request, futures)
+
+    context = view.context
+    try:
+        for layout in conditional.layoutChain(view):
+            startUpdates(context, request, layout.gather)
+            context = layout.context
+    except LayoutNotFound:
+        pass
+
+    gatherPending(request)
+
+
+def queryGathered(request, context, name):
+    """ pagelet with started asynchronous update """
+    annotations = getattr(request, 'annotations', None)
+    if not annotations:
+        return None
+
+    state = annotations.get(ANNOTATION_KEY)
+    if not state:
+        return None
+
+    item = state['pagelets'].pop((id(context), getattr(name, 'name', name)), None)
+    if item is not None and item[0] is context:
+        return item[1]
+
+
+def gather(futures, timeout=None):
+    """ wait for all futures, futures that are not done
+    before timeout are cancelled. Returns number of cancelled futures """
+    if timeout:
+        deadline = time.time() + timeout
+    else:
+        deadline = None
+
+    cancelled = 0
+    for future in futures:
+        if deadline is None:
+            future.wait()
+        elif not future.wait(max(deadline - time.time(), 0)):
+            if future.cancel():
+                cancelled += 1
+
+    if cancelled:
+        logging.getLogger('zojax.layout').warning(
+            "Asynchronous pagelet updates timed out: %s", cancelled)
+    return cancelled
+
+
+def gatherPending(request, timeout=None):
+    """ wait for all pending futures of request, by default
+    `waittimeout` seconds """
+    annotations = getattr(request, 'annotations', None)
+    if not annotations:
+        return 0
+
+    state = annotations.get(ANNOTATION_KEY)
+    if not state or not state['pending']:
+        return 0
+
+    futures = state['pending']
+    state['pending'] = []
+    return gather(futures, timeout or waittimeout)
@@ -49,6 +49,17 @@ class IPagelet(interface.Interface):
     def isAvailable():
         """Is available"""
 
+    def updateAsync():
+        """Start slow operations, return future, list of futures or None.
+        Futures are done before `update` is called."""
+
+    def validator():
+        """Version of page for conditional requests, None if conditional
+        requests are not supported."""
+
+    def lastModified():
+        """Modification time of page, datetime, timestamp or None."""
+
 
 class IPageletType(interface.interfaces.IInterface):
     """ pagelet interface type """
@@ -73,6 +84,22 @@ class ILayout(IBrowserPage):
     def render():
         """Render the layout """
 
+    def prepare(layout=None, view=None):
+        """Update layout and find parent layout, return parent layout
+        and arguments for parent layout."""
+
+    def stream(layout=None, view=None):
+        """Render layouts chain as iterator of unicode chunks. Layouts
+        are rendered with `prepare` and `render`, layout that overrides
+        `__call__` is called instead and rest of chain is not streamed."""
+
+    def validator():
+        """Version of layout for conditional requests, None if conditional
+        requests are not supported."""
+
+    def lastModified():
+        """Modification time of layout, datetime, timestamp or None."""
+
 
 class ILayoutView(interface.Interface):
     """ layout view """
@@ -98,3 +125,50 @@ class ILayoutCreatedEvent(interface.Interface):
     layoutclass = interface.Attribute('Generated class for layout')
 
     keywords = interface.Attribute('Keywords')
+
+
+class IPageletCache(interface.Interface):
+    """ pagelet fragments cache, api is compatible with memcache client """
+
+    def get(key):
+        """Return cached value or None"""
+
+    def set(key, value, time=0):
+        """Cache value, `time` is time to live in seconds, 0 - no expiration"""
+
+    def delete(key):
+        """Remove value from cache"""
+
+    def flush_all():
+        """Remove all values from cache"""
+
+
+class IPageletCacheKey(interface.Interface):
+    """ pagelet cache key component, named utility """
+
+    def __call__(pagelet):
+        """Return key component value for pagelet"""
+
+
+class IStreamingRequest(interface.Interface):
+    """ marker interface for request, server iterates result of
+    this request before request is closed, so page can be rendered
+    by layout as iterator of chunks """
+
+
+class IRenderTimingEvent(interface.Interface):
+    """ page is rendered, render timing is collected """
+
+    request = interface.Attribute('Request')
+
+    timer = interface.Attribute('Render timer, tree of render spans')
+
+
+class IUserAgentFilter(interface.Interface):
+    """ requests from some user agents (for example link preview of
+    MS Office products) are answered with empty page, before
+    pagelet is updated """
+
+    def __call__(request):
+        """Return True if request should be answered with empty page,
+        filter can set response status and headers"""
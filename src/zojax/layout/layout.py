@@ -15,14 +15,20 @@
 
 $Id$
 """
+import time
 from zope import interface
 from zope.publisher import browser
+from zope.publisher.interfaces import NotFound
 from zope.component import getMultiAdapter
 from zope.traversing.api import getRoot
 
 from z3c.pt.pagetemplate import ViewPageTemplateFile
 
+from zojax.layout.result import Fragments
 from zojax.layout.pagelet import queryLayout
+from zojax.layout.timing import queryTimer
+from zojax.layout.prefetch import prefetchPagelets
+from zojax.layout.gather import startUpdates, gatherPending
 from zojax.layout.interfaces import LayoutNotFound
 from zojax.layout.interfaces import ILayout, ILayoutView, ILayoutTemplateFile
 
@@ -43,33 +49,89 @@ class LayoutTemplateFile(ViewPageTemplateFile):
         return namespace
 
 
-class Layout(browser.BrowserPage):
+class LayoutBase(object):
+    """ layout behaviour without instance state, see Layout
+    and CompactLayout """
+    __slots__ = ()
     interface.implements(ILayout)
 
+    uid = u''
     template = None
     mainview = None
     maincontext = None
 
-    def __init__(self, view, context, request):
-        self.view = view
-        self.context = context
-        self.request = request
+    cache = None
+    cachettl = 0
+    streaming = True
 
-        self.__parent__ = view.__parent__
+    prefetch = ()
+    prefetchtimeout = 5.0
+
+    gather = ()
+    gathertimeout = 5.0
 
     def update(self):
         pass
 
+    def validator(self):
+        """ version of layout for conditional requests, layouts render
+        dynamic pagelets so conditional requests are disabled by default.
+        Layout has to return own version to enable them """
+        return None
+
+    def lastModified(self):
+        return None
+
     def render(self):
+        if self.prefetch:
+            prefetchPagelets(self.view.context, self.request,
+                             self.prefetch, self.prefetchtimeout)
+
         if self.template is None:
             view = getMultiAdapter((self, self.request), ILayoutView)
             view.update()
             return view.render()
 
-        return self.template(
-            self, context=self.view.context, request=self.request)
+        view = self.view
+        if isinstance(view, _Hole):
+            # layout chain is streamed
+            return self.template(
+                self, context=view.context, request=self.request)
+
+        slot = _ViewSlot(view)
+        self.view = slot
+        try:
+            rendered = self.template(
+                self, context=view.context, request=self.request)
+        finally:
+            self.view = view
+
+        return slot.fragments(rendered)
 
     def __call__(self, layout=None, view=None, *args, **kw):
+        parent, kwargs = self.prepare(layout, view)
+        if parent is None:
+            gatherPending(self.request, self.gathertimeout)
+            return self.render()
+
+        kw.update(kwargs)
+        return parent(*args, **kw)
+
+    def prepare(self, layout=None, view=None):
+        """ update layout and find parent layout,
+        returns parent layout and arguments for parent layout """
+        timer = queryTimer(self.request)
+        if timer is None:
+            return self._prepare(layout, view)
+
+        span = timer.start('layout', self.__name__, self.uid)
+        try:
+            return self._prepare(layout, view, span)
+        finally:
+            timer.stop(span)
+
+    def _bind(self, layout=None, view=None):
+        # set main view and inner layout, returns view of layout
         if view is None:
             view = self.view
         self.mainview = view
@@ -78,17 +140,38 @@ class Layout(browser.BrowserPage):
         layoutview = self.view
         if layout is not None:
             self.view = layout
+        return layoutview
+
+    def _prepare(self, layout=None, view=None, span=None):
+        layoutview = self._bind(layout, view)
+        view = self.mainview
+
+        if self.gather:
+            startUpdates(self.view.context, self.request, self.gather)
+
+        if span is None:
+            self.update()
+            return self._queryParent(layoutview, view)
 
+        t = time.time()
         self.update()
+        span.update = time.time() - t
 
+        t = time.time()
+        try:
+            return self._queryParent(layoutview, view)
+        finally:
+            span.lookup = time.time() - t
+
+    def _queryParent(self, layoutview, view):
         if self.layout is None:
-            return self.render()
+            return None, None
 
         if self.__name__ != self.layout:
             layout = queryLayout(
                 view, self.request, view.__parent__, name=self.layout)
             if layout is not None:
-                return layout(layout=self, view=view, *args, **kw)
+                return layout, {'layout': self, 'view': view}
         else:
             context = self.context
             if layoutview.context is not context.__parent__:
@@ -101,12 +184,166 @@ class Layout(browser.BrowserPage):
 
             layout = queryLayout(self, self.request, context, name=self.layout)
             if layout is not None:
-                return layout(view=view, *args, **kw)
+                return layout, {'view': view}
 
         layout = queryLayout(
             self.view, self.context, self.request, name=self.layout)
 
         if layout is not None:
-            return layout(*args, **kw)
+            return layout, {}
 
         raise LayoutNotFound(self.layout)
+
+    def stream(self, layout=None, view=None):
+        """ render layout chain as iterator of unicode chunks,
+        parent layout header is available before main view is rendered """
+        chain = []
+        parent, kwargs = self, {'layout': layout, 'view': view}
+        while parent is not None:
+            # layout with own __call__ renders rest of chain
+            if _customCall(parent):
+                return iter((parent(**kwargs),))
+
+            chain.append(parent)
+            parent, kwargs = parent.prepare(**kwargs)
+
+        gatherPending(self.request, chain[-1].gathertimeout)
+
+        # layout can set response headers during rendering,
+        # in this case we can't stream
+        for layout in chain:
+            if not layout.streaming:
+                return iter((chain[-1].render(),))
+
+        return _streamChain(chain, len(chain)-1)
+
+
+class Layout(LayoutBase, browser.BrowserPage):
+    interface.implements(ILayout)
+
+    def __init__(self, view, context, request):
+        self.view = view
+        self.context = context
+        self.request = request
+
+        self.__parent__ = view.__parent__
+
+
+class CompactLayout(LayoutBase):
+    """ layout without instance dictionary """
+    __slots__ = ('view', 'context', 'request', '__parent__',
+                 'mainview', 'maincontext')
+    interface.implements(ILayout)
+
+    __name__ = None
+
+    def __init__(self, view, context, request):
+        self.view = view
+        self.context = context
+        self.request = request
+        self.mainview = None
+        self.maincontext = None
+
+        self.__parent__ = view.__parent__
+
+    def browserDefault(self, request):
+        return self, ()
+
+    def publishTraverse(self, request, name):
+        raise NotFound(self, name, request)
+
+
+def _customCall(layout):
+    call = getattr(type(layout).__call__, 'im_func', None)
+    return call is not LayoutBase.__call__.im_func
+
+
+class _Hole(object):
+    """ placeholder for view rendered by layout """
+
+    def __init__(self, view):
+        self.__dict__['_view'] = view
+        self.__dict__['marker'] = u'<!-- zojax.layout:%x -->'%id(self)
+
+    def render(self, *args, **kw):
+        return self.marker
+
+    def __getattr__(self, name):
+        return getattr(self._view, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._view, name, value)
+
+
+class _ViewSlot(object):
+    """ view rendered by layout template, output of view is kept as
+    fragment of layout output instead of concatenated string """
+
+    def __init__(self, view):
+        self.__dict__['_view'] = view
+        self.__dict__['marker'] = u'\ufdd0%s\ufdd0'%id(self)
+        self.__dict__['results'] = []
+
+    def render(self, *args, **kw):
+        result = self._view.render(*args, **kw)
+        if not isinstance(result, unicode):
+            self.results.append(None)
+            return result
+
+        self.results.append(result)
+        return u'%s%s%s'%(self.marker, result, self.marker)
+
+    def fragments(self, rendered):
+        parts = unicode(rendered).split(self.marker)
+        if len(parts) == 1:
+            return rendered
+
+        # view output is inserted as is ('structure')
+        results = self.results
+        if len(parts) == len(results)*2 + 1 and None not in results:
+            for idx, result in enumerate(results):
+                if parts[idx*2 + 1] != result:
+                    break
+            else:
+                for idx, result in enumerate(results):
+                    parts[idx*2 + 1] = result
+                return Fragments(*parts)
+
+        return u''.join(parts)
+
+    def __getattr__(self, name):
+        return getattr(self._view, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._view, name, value)
+
+
+def _streamChain(chain, idx):
+    layout = chain[idx]
+    view = layout.view
+
+    hole = _Hole(view)
+    layout.view = hole
+    try:
+        rendered = unicode(layout.render())
+    finally:
+        layout.view = view
+
+    parts = rendered.split(hole.marker)
+    if len(parts) == 1:
+        yield rendered
+        return
+
+    if len(parts) > 2:
+        yield view.render().join(parts)
+        return
+
+    yield parts[0]
+
+    if idx and view is chain[idx-1]:
+        for chunk in _streamChain(chain, idx-1):
+            yield chunk
+    else:
+        yield view.render()
+
+    yield parts[1]
@@ -15,22 +15,54 @@
 
 $Id$
 """
+from zope.component import queryUtility
 from zope.app.pagetemplate import ViewPageTemplateFile
 
+from zojax.layout.result import Fragments
+from zojax.layout.interfaces import IPageletCache
+from zojax.layout.pageletcache import getCacheKey
+
 
 class DefaultLayoutPortal(object):
 
     content = ViewPageTemplateFile('layoutportaltmpl.pt')
 
-    def render(self):
-        rendered = self.template(
-            self, context=self.view.context, request=self.request)
+    # cache key and time to live of portal shell,
+    # set by 'cache' and 'cachettl' attributes of zojax:layout
+    cache = None
+    cachettl = 0
 
-        tmpl = self.content(self)
+    def render(self):
+        rendered = super(DefaultLayoutPortal, self).render()
 
-        parts = tmpl.split(u'<!-- default layout portal contents -->', 1)
+        parts = self.renderShell()
 
         if len(parts) == 2:
-            return parts[0] + rendered + parts[1]
+            return Fragments(parts[0], rendered, parts[1])
         else:
             return rendered
+
+    def renderShell(self):
+        """ render (prefix, suffix) of portal, cache it if layout
+        has cache key """
+        cache = key = None
+        if self.cache is not None:
+            cache = queryUtility(IPageletCache)
+            if cache is not None:
+                key = getCacheKey(self)
+
+        if key is not None:
+            parts = cache.get(key)
+            if parts is not None:
+                return parts
+
+        tmpl = self.content(self)
+
+        parts = tuple(tmpl.split(u'<!-- default layout portal contents -->', 1))
+        if len(parts) != 2:
+            parts = ()
+
+        if key is not None:
+            cache.set(key, parts, self.cachettl or 0)
+
+        return parts
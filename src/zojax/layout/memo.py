@@ -0,0 +1,77 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" request scoped memo of idempotent pagelets
+
+$Id$
+"""
+ANNOTATION_KEY = 'zojax.layout.memo'
+
+
+def getMemo(request, create=True):
+    annotations = getattr(request, 'annotations', None)
+    if annotations is None:
+        return None
+
+    if create:
+        return annotations.setdefault(ANNOTATION_KEY, {})
+    return annotations.get(ANNOTATION_KEY)
+
+
+def _get(memo, key, contexts):
+    # memo keeps references to contexts, so ids are not reused
+    item = memo.get(key)
+    if item is not None:
+        for ob, other in zip(item[0], contexts):
+            if ob is not other:
+                return None
+        return item[1]
+
+
+def renderMemoized(pagelet, updateAndRender):
+    """ pagelet is updated and rendered once per request for same
+    contexts, pagelet should be marked with 'memoize' attribute """
+    memo = getMemo(pagelet.request)
+    if memo is None:
+        return updateAndRender()
+
+    contexts = (pagelet.context,) + tuple(pagelet.contexts)
+    key = _key((pagelet.__class__, pagelet.__name__), contexts)
+
+    result = _get(memo, key, contexts)
+    if result is None:
+        result = updateAndRender()
+        memo[key] = (contexts, result)
+
+    return result
+
+
+def queryMemoized(request, name, contexts):
+    """ result of memoized pagelet rendered with 'pagelet:' expression,
+    `contexts` are context and additional contexts of pagelet """
+    memo = getMemo(request, False)
+    if not memo:
+        return None
+
+    return _get(memo, _key(name, contexts), contexts)
+
+
+def setMemoized(request, name, contexts, result):
+    memo = getMemo(request)
+    if memo is not None:
+        memo[_key(name, contexts)] = (contexts, result)
+
+
+def _key(name, contexts):
+    # `name` is name of 'pagelet:' expression or pagelet class and name
+    return (getattr(name, 'name', name),) + tuple([id(ob) for ob in contexts])
@@ -15,68 +15,276 @@
 
 $Id$
 """
-import logging, sys, re
+import time, logging
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 from zope import interface, component
-from zope.component import queryUtility, queryAdapter, queryMultiAdapter
+from zope.interface import providedBy
+from zope.component import getSiteManager
+from zope.component import queryUtility, queryMultiAdapter
 from zope.publisher.browser import BrowserPage
 from zope.publisher.interfaces import NotFound
-from zope.publisher.interfaces.browser import IBrowserPublisher
+from zope.publisher.interfaces.browser import IBrowserPage, IBrowserPublisher
 from zope.tales.expressions import SimpleModuleImporter
 from zope.app.publisher.browser import queryDefaultViewName
 
+from result import streamResult, LayoutStreamResult
+from timing import queryTimer
+from useragent import filterRequest
+from conditional import notModified
+import defer
+import gather
+from memo import renderMemoized
+from pageletcache import renderCached
+from cache import LRUCache, layoutCache, pageletMissCache, selectorCache
+from cache import pageletContextCache
 from interfaces import ILayout, IPagelet, IPageletType, IPageletContext
+from interfaces import IStreamingRequest
+
+_marker = object()
+_modules = SimpleModuleImporter()
+_selectors = LRUCache(1000)
 
 
 def queryLayout(view, request, context=None, iface=ILayout, name=''):
     if context is None:
         context = view.context
 
+    contexts = []
     while context is not None:
-        layout = queryMultiAdapter((view, context, request), iface, name)
+        contexts.append(context)
+        context = getattr(context, '__parent__', None)
+
+    # layout lookup depends only on interfaces of view, request and
+    # all parents, so we can remember on which level layout has been found
+    adapters = getSiteManager().adapters
+    viewSpec = providedBy(view)
+    requestSpec = providedBy(request)
+    specs = tuple([providedBy(context) for context in contexts])
+
+    cache = layoutCache.get(adapters)
+    key = (viewSpec, specs, requestSpec, iface, name)
+
+    found = cache.get(key, _marker)
+    if found is None:
+        return None
+
+    if found is not _marker:
+        level, factory = found
+        layout = factory(view, contexts[level], request)
         if layout is not None:
             return layout
 
-        context = getattr(context, '__parent__', None)
+    # factory that returns None depends on objects, not only on
+    # their interfaces, result of such lookup is not cached
+    conditional = False
+    for level in range(len(contexts)):
+        factory = adapters.lookup(
+            (viewSpec, specs[level], requestSpec), iface, name)
+        if factory is None:
+            continue
+
+        layout = factory(view, contexts[level], request)
+        if layout is not None:
+            if conditional:
+                cache.pop(key)
+            else:
+                cache[key] = (level, factory)
+            return layout
 
+        conditional = True
+
+    if conditional:
+        cache.pop(key)
+    else:
+        cache[key] = None
     return None
 
 
-def queryPagelet(context, request, name, modules=SimpleModuleImporter()):
-    pageletName = u''
+class PageletSelector(object):
+    """ parsed pagelet name: '<pagelet type>+<pagelet name>' """
 
-    if name:
-        splited = name.split(u'+', 1)
-        if len(splited) > 1:
-            name, pageletName = splited
+    def __init__(self, name):
+        self.name = name
+        self.typeName = name
+        self.pageletName = u''
 
         if name:
-            iface = queryUtility(IPageletType, name)
-        else:
-            iface = IPagelet
+            splited = name.split(u'+', 1)
+            if len(splited) > 1:
+                self.typeName, self.pageletName = splited
+
+    def getInterface(self, modules=None):
+        if not self.typeName:
+            return IPagelet
+
+        if modules is not None:
+            return self.resolve(modules)
+
+        cache = selectorCache.get(getSiteManager().utilities)
+
+        iface = cache.get(self.typeName, _marker)
+        if iface is _marker:
+            try:
+                iface = self.resolve(_modules)
+            except KeyError:
+                iface = None
+            cache[self.typeName] = iface
+
+        if iface is None:
+            raise KeyError(self.typeName)
+        return iface
+
+    def resolve(self, modules):
+        iface = queryUtility(IPageletType, self.typeName)
 
         if iface is None:
             try:
-                iface, iname = name.rsplit('.', 1)
+                iface, iname = self.typeName.rsplit('.', 1)
                 iface = getattr(modules[iface], iname)
             except:
-                raise KeyError(name)
-    else:
-        iface = IPagelet
+                raise KeyError(self.typeName)
+
+        return iface
+
+    def __reduce__(self):
+        return (getPageletSelector, (self.name,))
+
+    def __repr__(self):
+        return '<%s %r>'%(self.__class__.__name__, self.name)
+
+
+def getPageletSelector(name):
+    if isinstance(name, PageletSelector):
+        return name
+
+    selector = _selectors.get(name)
+    if selector is None:
+        selector = PageletSelector(name)
+        _selectors[name] = selector
+
+    return selector
+
+
+def queryPagelet(context, request, name, modules=None):
+    selector = getPageletSelector(name)
+
+    sm = getSiteManager()
+    missing = pageletMissCache.get(sm.adapters, sm.utilities)
+    key = (selector.name, providedBy(context), providedBy(request))
+    if missing.get(key, False):
+        return None
+
+    iface = selector.getInterface(modules)
 
     if iface.providedBy(context):
         return context
 
-    contexts = queryAdapter(context, IPageletContext, name)
-    if contexts is not None:
-        required = [context]
-        if type(contexts) in (list, tuple):
-            required.extend(contexts)
-        else:
-            required.append(contexts)
-        required.append(request)
-        return queryMultiAdapter(required, iface, pageletName)
+    cache = pageletContextCache.get(sm.adapters)
+
+    ckey = (key[1], selector.typeName)
+    factory = cache.get(ckey, _marker)
+    if factory is _marker:
+        factory = sm.adapters.lookup(
+            (key[1],), IPageletContext, selector.typeName)
+        cache[ckey] = factory
+
+    if factory is not None:
+        contexts = factory(context)
+        if contexts is not None:
+            return _queryContextPagelet(
+                sm.adapters, cache, context, contexts, request,
+                iface, selector.pageletName)
+
+    # remember misses, result depends only on registry state.
+    # Misses of pagelets with context adapter depend on context object
+    contextFactory = factory
+    factory = sm.adapters.lookup(
+        (key[1], key[2]), iface, selector.pageletName)
+    if factory is None:
+        if contextFactory is None:
+            missing[key] = True
+        return None
+
+    return factory(context, request)
+
+
+def _queryContextPagelet(
+    adapters, cache, context, contexts, request, iface, name):
+    # pagelet with additional contexts, factory is cached
+    # per interfaces of all contexts
+    if type(contexts) in (list, tuple):
+        required = (context,) + tuple(contexts) + (request,)
     else:
-        return queryMultiAdapter((context, request), iface, pageletName)
+        required = (context, contexts, request)
+
+    specs = tuple([providedBy(ob) for ob in required])
+
+    key = (specs, iface, name)
+    factory = cache.get(key, _marker)
+    if factory is _marker:
+        factory = adapters.lookup(specs, iface, name)
+        cache[key] = factory
+
+    if factory is not None:
+        return factory(*required)
+
+
+def queryPagelets(contexts, request, name, modules=None):
+    """ pagelets for many contexts, returns generator of
+    (context, pagelet) pairs, pagelet is None if it can't be found.
+    Pagelet is looked up once for contexts that provide same interfaces """
+    selector = getPageletSelector(name)
+    iface = selector.getInterface(modules)
+
+    adapters = getSiteManager().adapters
+    reqspec = providedBy(request)
+
+    factories = {}
+    for context in contexts:
+        spec = providedBy(context)
+
+        factory = factories.get(spec, _marker)
+        if factory is _marker:
+            if spec.isOrExtends(iface):
+                factory = None
+            elif adapters.lookup(
+                (spec,), IPageletContext, selector.typeName) is not None:
+                factory = queryPagelet
+            else:
+                factory = adapters.lookup(
+                    (spec, reqspec), iface, selector.pageletName)
+            factories[spec] = factory
+
+        if factory is None:
+            if spec.isOrExtends(iface):
+                yield context, context
+            else:
+                yield context, None
+        elif factory is queryPagelet:
+            yield context, queryPagelet(context, request, selector, modules)
+        else:
+            yield context, factory(context, request)
+
+
+def renderPagelets(contexts, request, name, modules=None):
+    """ update and render pagelets for many contexts, returns generator
+    of rendered pagelets, output is empty if pagelet can't be found """
+    for context, pagelet in queryPagelets(contexts, request, name, modules):
+        if pagelet is None:
+            yield u''
+            continue
+
+        try:
+            yield pagelet.updateAndRender()
+        except Exception, err:
+            log = logging.getLogger('zojax.layout')
+            log.exception(err)
+            yield u''
 
 
 @interface.implementer(IPagelet)
@@ -89,24 +297,24 @@ def queryDefaultView(context, request):
             return view
 
 
-class BrowserPagelet(BrowserPage):
+class PageletBase(object):
+    """ pagelet behaviour without instance state, see BrowserPagelet
+    and CompactPagelet """
+    __slots__ = ()
     interface.implements(IPagelet)
 
     template = None
     layoutname = u''
     isRedirected = False
 
-    def __init__(self, context, *args):
-        request = args[-1]
-        super(BrowserPagelet, self).__init__(context, request)
-
-        args = args[:-1]
-        self.contexts = args
-
-        for idx in range(len(args)):
-            setattr(self, 'context%s'%idx, args[idx])
+    cache = None
+    cachettl = 0
+    memoize = False
+    threadsafe = False
 
-        self.__parent__ = context
+    esi = False
+    defer = False
+    cachecontrol = None
 
     def update(self):
         pass
@@ -122,6 +330,18 @@ class BrowserPagelet(BrowserPage):
             raise LookupError("Can't find IPagelet for this pagelet.")
 
     def updateAndRender(self):
+        if self.memoize:
+            return renderMemoized(self, self._updateAndRender)
+        return self._updateAndRender()
+
+    def _updateAndRender(self):
+        timer = queryTimer(self.request)
+        if timer is not None:
+            return timer.updateAndRender(self)
+
+        if self.cache is not None:
+            return renderCached(self)
+
         self.update()
         if self.isRedirected or not self.isAvailable():
             return u''
@@ -131,6 +351,20 @@ class BrowserPagelet(BrowserPage):
     def isAvailable(self):
         return True
 
+    def updateAsync(self):
+        """ start slow operations, returns future or list of futures,
+        futures are done before update is called """
+        return None
+
+    def validator(self):
+        """ version of page for conditional requests,
+        None - conditional requests are not supported """
+        return None
+
+    def lastModified(self):
+        """ modification time of page, datetime or timestamp """
+        return None
+
     def redirect(self, url=''):
         if url:
             self.request.response.redirect(url)
@@ -138,25 +372,143 @@ class BrowserPagelet(BrowserPage):
         self.isRedirected = True
 
     def __call__(self, *args, **kw):
-        self.update()
+        timer = queryTimer(self.request)
+        if timer is None:
+            return self._call()
+
+        span = timer.start('view', self.__name__)
+        result = None
+        try:
+            result = self._call(span)
+        finally:
+            if not isinstance(result, LayoutStreamResult):
+                timer.stop(span, result)
+
+        if isinstance(result, LayoutStreamResult):
+            # layouts are rendered when stream is iterated
+            def finish():
+                timer.stop(span)
+                timer.finish()
+            result.finish = finish
+        else:
+            timer.finish()
+        return result
 
+    def _call(self, span=None):
         # see ticket #415 - workaround for opening links from MS Office products
-        ua = self.request.get('HTTP_USER_AGENT')
-        uri = self.request.get('REQUEST_URI')
+        if filterRequest(self.request):
+            return u''
 
-        if ua and re.search('[^\w](Word|Excel|PowerPoint|ms-office)([^\w]|\z)', ua, re.I):
+        # client has fresh copy, update and layouts are skipped
+        if notModified(self):
             return u''
 
+        futures = self.updateAsync()
+        if futures is not None:
+            gather.startViewUpdates(self, futures)
+
+        if span is None:
+            self.update()
+        else:
+            t = time.time()
+            self.update()
+            span.update = time.time() - t
+
 
         if self.isRedirected or self.request.response.getStatus() in (302, 303):
             return u''
 
+        if span is not None:
+            t = time.time()
+
         layout = queryLayout(
             self, self.request, self.__parent__, name=self.layoutname)
-        if layout is None:
-            return self.render()
-        else:
+
+        if span is not None:
+            span.lookup = time.time() - t
+            t = time.time()
+
+        try:
+            if layout is None:
+                return self.render()
+
+            if IStreamingRequest.providedBy(self.request):
+                return streamResult(self.request, layout.stream())
+
             return layout()
+        finally:
+            if span is not None:
+                span.render = time.time() - t
+
+
+class BrowserPagelet(PageletBase, BrowserPage):
+    interface.implements(IPagelet)
+
+    def __init__(self, context, *args):
+        request = args[-1]
+        super(BrowserPagelet, self).__init__(context, request)
+
+        args = args[:-1]
+        self.contexts = args
+
+        for idx in range(len(args)):
+            setattr(self, 'context%s'%idx, args[idx])
+
+        self.__parent__ = context
+
+
+class contextN(object):
+    """ additional context of compact pagelet """
+
+    def __init__(self, idx):
+        self.idx = idx
+
+    def __get__(self, inst, klass):
+        if inst is None:
+            return self
+
+        try:
+            return inst.contexts[self.idx]
+        except IndexError:
+            raise AttributeError('context%s'%self.idx)
+
+
+class CompactPagelet(PageletBase):
+    """ pagelet without instance dictionary, all state is stored
+    in fixed slots. Subclasses should define __slots__ for
+    own attributes """
+    __slots__ = ('context', 'request', 'contexts', '__parent__', 'isRedirected')
+    interface.implements(IPagelet, IBrowserPage)
+
+    __name__ = None
+
+    context0 = contextN(0)
+    context1 = contextN(1)
+    context2 = contextN(2)
+    context3 = contextN(3)
+    context4 = contextN(4)
+
+    def __init__(self, context, *args):
+        self.context = context
+        self.request = args[-1]
+        self.contexts = args[:-1]
+        self.__parent__ = context
+        self.isRedirected = False
+
+    def __getattr__(self, name):
+        # additional contexts without descriptor
+        if name.startswith('context') and name[7:].isdigit():
+            try:
+                return self.contexts[int(name[7:])]
+            except IndexError:
+                pass
+        raise AttributeError(name)
+
+    def browserDefault(self, request):
+        return self, ()
+
+    def publishTraverse(self, request, name):
+        raise NotFound(self, name, request)
 
 
 class PageletPublisher(object):
@@ -164,18 +516,27 @@ class PageletPublisher(object):
     component.adapts(interface.Interface, interface.Interface)
 
     render = True
+    pagelet = None
 
     def __init__(self, context, request):
         self.context = context
         self.request = request
 
     def publishTraverse(self, request, name):
+        if name == defer.BATCH:
+            return self.batch(defer.batchNames(request))
+
         try:
-            return self[name]
+            result = self[name]
         except KeyError:
-            pass
+            raise NotFound(self.context, name, request)
 
-        raise NotFound(self.context, name, request)
+        # pagelet is loaded by url, for example by edge cache
+        cachecontrol = getattr(self.pagelet, 'cachecontrol', None)
+        if cachecontrol:
+            request.response.setHeader('Cache-Control', cachecontrol)
+
+        return result
 
     def __call__(self, name=''):
         try:
@@ -189,6 +550,7 @@ class PageletPublisher(object):
         view = queryPagelet(self.context, self.request, name)
 
         if view is not None:
+            self.pagelet = view
             try:
                 return view.updateAndRender()
             except Exception, err:
@@ -197,6 +559,22 @@ class PageletPublisher(object):
 
         raise KeyError(name)
 
+    def batch(self, names):
+        """ render several pagelets, returns json map of pagelet name
+        to html, output of missing pagelet is empty """
+        self.request.annotations[defer.BATCH_KEY] = True
+
+        result = {}
+        for name in names:
+            try:
+                result[name] = self[name]
+            except KeyError:
+                result[name] = u''
+
+        self.request.response.setHeader(
+            'Content-Type', 'application/json;charset=utf-8')
+        return json.dumps(result)
+
     def browserDefault(self, request):
         return self.context, ('',)
 
@@ -207,6 +585,7 @@ class PageletObjectPublisher(PageletPublisher):
         view = queryPagelet(self.context, self.request, name)
 
         if view is not None:
+            self.pagelet = view
             try:
                 view.update()
                 return view
@@ -0,0 +1,173 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" pagelet fragments cache
+
+$Id$
+"""
+import time, logging
+from zope import interface
+from zope.component import queryUtility, queryAdapter
+from zope.i18n.interfaces import IUserPreferredLanguages
+from zope.traversing.api import getPath
+
+from cache import LRUCache
+from interfaces import IPageletCache, IPageletCacheKey
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+# key component value, pagelet can't be cached
+NOCACHE = object()
+
+_time = time.time
+
+
+class RAMCache(object):
+    """ in-memory pagelet cache """
+    interface.implements(IPageletCache)
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.flush_all()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires, value = item
+        if expires and expires < _time():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value, time=0):
+        if time:
+            expires = _time() + time
+        else:
+            expires = 0
+
+        self._data[key] = (expires, value)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def flush_all(self):
+        self._data = LRUCache(self.maxsize)
+        self.hits = 0
+        self.misses = 0
+
+
+def getCacheKey(pagelet):
+    """ build cache key from pagelet cache key components """
+    ns = getattr(pagelet, 'cacheid', None)
+    if not ns:
+        ns = '%s.%s'%(pagelet.__class__.__module__, pagelet.__class__.__name__)
+
+    parts = [ns, pagelet.__name__]
+    for name in pagelet.cache:
+        if name.startswith('attr:'):
+            value = getattr(pagelet, name[5:], None)
+            if callable(value):
+                value = value()
+        else:
+            keypart = queryUtility(IPageletCacheKey, name)
+            if keypart is None:
+                logging.getLogger('zojax.layout').warning(
+                    "Can't find pagelet cache key component: %s", name)
+                return None
+            value = keypart(pagelet)
+
+        if value is NOCACHE:
+            return None
+        parts.append(value)
+
+    return 'zojax.layout:%s'%md5(repr(tuple(parts))).hexdigest()
+
+
+def renderCached(pagelet, updateAndRender=None):
+    """ update and render pagelet, use cached fragment if possible """
+    if updateAndRender is None:
+        updateAndRender = _updateAndRender
+
+    cache = queryUtility(IPageletCache)
+    if cache is None:
+        return updateAndRender(pagelet)
+
+    key = getCacheKey(pagelet)
+    if key is None:
+        return updateAndRender(pagelet)
+
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    result = updateAndRender(pagelet)
+    if not pagelet.isRedirected:
+        cache.set(key, result, pagelet.cachettl or 0)
+    return result
+
+
+def _updateAndRender(pagelet):
+    pagelet.update()
+    if pagelet.isRedirected or not pagelet.isAvailable():
+        return u''
+
+    return pagelet.render()
+
+
+# cache key components
+
+def contextKey(pagelet):
+    """ context and additional contexts oids (or paths) """
+    result = []
+    contexts = getattr(pagelet, 'contexts', ())
+    for context in (pagelet.context,) + tuple(contexts):
+        oid = getattr(context, '_p_oid', None)
+        if oid is None:
+            try:
+                oid = getPath(context)
+            except Exception:
+                return NOCACHE
+        result.append(oid)
+
+    return tuple(result)
+
+
+def principalKey(pagelet):
+    principal = getattr(pagelet.request, 'principal', None)
+    if principal is None:
+        return None
+    return principal.id
+
+
+def layerKey(pagelet):
+    return tuple([iface.__identifier__ for iface in
+                  interface.directlyProvidedBy(pagelet.request).flattened()])
+
+
+def languageKey(pagelet):
+    languages = queryAdapter(pagelet.request, IUserPreferredLanguages)
+    if languages is None:
+        return None
+
+    languages = languages.getPreferredLanguages()
+    if languages:
+        return languages[0]
+    return None
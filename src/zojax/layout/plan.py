@@ -0,0 +1,182 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" layout plan, static graph of layouts registered with zojax:layout
+
+$Id$
+"""
+import logging
+from zope import interface
+from zope.configuration.exceptions import ConfigurationError
+
+
+class LayoutRecord(object):
+
+    def __init__(self, name, parent, view, context, layer, factory):
+        self.name = name
+        self.parent = parent
+        self.view = view
+        self.context = context
+        self.layer = layer
+        self.factory = factory
+
+
+class LayoutPlan(object):
+    """ name -> parent name graph of registered layouts """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.records = {}
+        self.graph = {}
+        self.unreachable = {}
+        self.compiled = False
+
+    def add(self, key, name, parent, view, context, layer, factory):
+        self.records[key] = LayoutRecord(
+            name, parent, view, context, layer, factory)
+        self.compiled = False
+
+    def compile(self):
+        if self.compiled:
+            return
+
+        layers = {}
+        for record in self.records.values():
+            layers.setdefault(record.layer, []).append(record)
+
+        # edges of layer includes edges of all layers it extends,
+        # roots are layouts without parent layout
+        graph = {}
+        roots = {}
+        for layer in layers:
+            edges = {}
+            names = set()
+            for base, records in layers.items():
+                if not _extends(layer, base):
+                    continue
+
+                for record in records:
+                    parents = edges.setdefault(record.name, set())
+                    if record.parent is not None:
+                        parents.add(record.parent)
+                    else:
+                        names.add(record.name)
+
+            graph[layer] = edges
+            roots[layer] = names
+
+        unreachable = {}
+        for layer, edges in graph.items():
+            for name, parents in edges.items():
+                for parent in parents:
+                    if parent not in edges:
+                        logging.getLogger('zojax.layout').warning(
+                            "Layout %r uses unknown layout %r (layer %s)",
+                            name, parent, _layerName(layer))
+
+            cycle = _findCycle(edges)
+            if cycle:
+                raise ConfigurationError(
+                    "Layouts cycle", _layerName(layer), ' -> '.join(
+                        [repr(name) for name in cycle]))
+
+            names = _findUnreachable(edges, roots[layer])
+            if names:
+                unreachable[layer] = names
+                logging.getLogger('zojax.layout').warning(
+                    "Layouts can't reach layout without parent, "
+                    "rendering fails with LayoutNotFound: %s (layer %s)",
+                    ', '.join([repr(name) for name in sorted(names)]),
+                    _layerName(layer))
+
+        self.graph = graph
+        self.unreachable = unreachable
+        self.compiled = True
+
+
+def _extends(layer, base):
+    if interface.interfaces.IInterface.providedBy(layer):
+        return layer.isOrExtends(base)
+    return layer is base
+
+
+def _layerName(layer):
+    return getattr(layer, '__identifier__', repr(layer))
+
+
+def _findUnreachable(edges, roots):
+    # layout is reachable if chain of its parents ends with
+    # layout without parent, self references are searched on
+    # parent context so they don't make layout reachable
+    reachable = set(roots)
+
+    changed = True
+    while changed:
+        changed = False
+        for name, parents in edges.items():
+            if name in reachable:
+                continue
+
+            for parent in parents:
+                if parent != name and parent in reachable:
+                    reachable.add(name)
+                    changed = True
+                    break
+
+    return set(edges) - reachable
+
+
+def _findCycle(edges):
+    # self references are allowed, layout is searched on parent context
+    visited = set()
+
+    for start in edges:
+        if start in visited:
+            continue
+
+        path = []
+        stack = [(start, iter(edges.get(start, ())))]
+        onpath = set([start])
+        path.append(start)
+
+        while stack:
+            name, parents = stack[-1]
+            for parent in parents:
+                if parent == name:
+                    continue
+                if parent in onpath:
+                    return path[path.index(parent):] + [parent]
+                if parent not in visited:
+                    onpath.add(parent)
+                    path.append(parent)
+                    stack.append((parent, iter(edges.get(parent, ()))))
+                    break
+            else:
+                stack.pop()
+                onpath.discard(path.pop())
+                visited.add(name)
+
+    return None
+
+
+layoutPlan = LayoutPlan()
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(layoutPlan.clear)
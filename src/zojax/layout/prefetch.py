@@ -0,0 +1,96 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" parallel prefetch of independent pagelets
+
+Only pagelets declared as thread-safe are prefetched, they should not
+use persistent data. Other pagelets are rendered by layout template.
+
+$Id$
+"""
+import time, logging
+
+import workers
+from pagelet import queryPagelet
+
+ANNOTATION_KEY = 'zojax.layout.prefetch'
+
+
+def prefetchPagelets(context, request, names, timeout=None):
+    """ update and render pagelets in worker threads,
+    results are used by 'pagelet:' expressions """
+    prefetched = getattr(request, 'annotations', None)
+    if prefetched is None or not names:
+        return
+    prefetched = prefetched.setdefault(ANNOTATION_KEY, {})
+
+    pagelets = []
+    for name in names:
+        try:
+            pagelet = queryPagelet(context, request, name)
+        except Exception, err:
+            logging.getLogger('zojax.layout').exception(err)
+            continue
+
+        if pagelet is not None and getattr(pagelet, 'threadsafe', False):
+            pagelets.append((name, pagelet))
+
+    if not pagelets:
+        return
+
+    # pool is busy with timed out calls
+    if workers.isBusy():
+        logging.getLogger('zojax.layout').warning(
+            "Pagelet prefetch is disabled, all workers are late")
+        return
+
+    if timeout:
+        deadline = time.time() + timeout
+    else:
+        deadline = None
+
+    tasks = [(name, workers.submit(pagelet.updateAndRender))
+             for name, pagelet in pagelets]
+
+    for name, future in tasks:
+        if deadline is None:
+            future.wait()
+        else:
+            future.wait(max(deadline - time.time(), 0))
+
+        if future.cancel():
+            logging.getLogger('zojax.layout').warning(
+                "Pagelet prefetch timed out: %s", name)
+            result = u''
+        else:
+            try:
+                result = future.result()
+            except Exception, err:
+                logging.getLogger('zojax.layout').exception(err)
+                result = u''
+
+        prefetched[(id(context), name)] = (context, result)
+
+
+def queryPrefetched(request, context, name):
+    prefetched = getattr(request, 'annotations', None)
+    if not prefetched:
+        return None
+
+    prefetched = prefetched.get(ANNOTATION_KEY)
+    if not prefetched:
+        return None
+
+    item = prefetched.pop((id(context), getattr(name, 'name', name)), None)
+    if item is not None and item[0] is context:
+        return item[1]
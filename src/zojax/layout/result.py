@@ -0,0 +1,113 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" publisher results
+
+$Id$
+"""
+import zope.contenttype.parse
+from zope import interface, component
+from zope.publisher.http import getCharsetUsingRequest
+from zope.publisher.interfaces.http import IResult, IHTTPRequest
+
+
+class Fragments(unicode):
+    """ rendered page, unicode string that keeps list of fragments it
+    is composed from. Publisher encodes fragments separately """
+
+    def __new__(cls, *fragments):
+        items = []
+        for fragment in fragments:
+            if isinstance(fragment, Fragments):
+                items.extend(fragment.fragments)
+            elif fragment:
+                items.append(fragment)
+
+        self = unicode.__new__(cls, u''.join(items))
+        self.fragments = items
+        return self
+
+    def __repr__(self):
+        return '<%s %r>'%(self.__class__.__name__, self.fragments)
+
+
+def setCharset(request, charset=None):
+    """ set charset of response content type like publisher does
+    for unicode results, charset of content type header has priority
+    over charset negotiated with request. Returns charset """
+    response = request.response
+    major, minor, params = zope.contenttype.parse.parse(
+        response.getHeader('content-type') or 'text/html')
+
+    if charset is None:
+        charset = params.get('charset') or \
+            getCharsetUsingRequest(request) or 'utf-8'
+
+    params['charset'] = charset
+    response.setHeader('content-type', '%s/%s;%s'%(
+        major, minor, ';'.join(['%s=%s'%item for item in params.items()])))
+    return charset
+
+
+@component.adapter(Fragments, IHTTPRequest)
+@interface.implementer(IResult)
+def fragmentsResult(fragments, request):
+    """ encode fragments without joining them """
+    encoding = setCharset(request)
+
+    try:
+        result = _encode(fragments.fragments, encoding)
+    except UnicodeEncodeError:
+        # same as publisher, utf-8 is used if page can't be encoded
+        result = _encode(fragments.fragments, setCharset(request, 'utf-8'))
+
+    request.response.setHeader(
+        'content-length', str(sum([len(fragment) for fragment in result])))
+    return result
+
+
+def _encode(fragments, encoding):
+    result = []
+    for fragment in fragments:
+        if isinstance(fragment, unicode):
+            fragment = fragment.encode(encoding)
+        result.append(fragment)
+    return result
+
+
+class LayoutStreamResult(object):
+    """ iterable result, encodes rendered chunks on the fly """
+    interface.implements(IResult)
+
+    # called when stream is iterated or closed
+    finish = None
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self.chunks = chunks
+        self.encoding = encoding
+
+    def __iter__(self):
+        encoding = self.encoding
+        try:
+            for chunk in self.chunks:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode(encoding)
+                if chunk:
+                    yield chunk
+        finally:
+            if self.finish is not None:
+                self.finish()
+
+
+def streamResult(request, chunks):
+    return LayoutStreamResult(chunks, setCharset(request))
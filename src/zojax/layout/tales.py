@@ -15,24 +15,67 @@
 
 $Id$
 """
-import logging, sys
+import time, logging, sys
 from zope.tales.expressions import StringExpr, SimpleModuleImporter
 from zope.component import queryUtility, queryAdapter, queryMultiAdapter
 
 from pagelet import queryPagelet
+from timing import queryTimer
+from prefetch import queryPrefetched
+from memo import queryMemoized, setMemoized
+from gather import queryGathered
+from esi import esiEnabled, esiInclude
+from defer import isDeferred, deferPlaceholder
 from interfaces import IPagelet, IPageletType, IPageletContext
 
 
 class PageletExpression(object):
 
     def render(self, context, request, view, name):
+        prefetched = queryPrefetched(request, context, name)
+        if prefetched is not None:
+            return prefetched
+
+        # pagelet without additional contexts
+        memoized = queryMemoized(request, name, (context,))
+        if memoized is not None:
+            return memoized
+
+        timer = queryTimer(request)
         try:
-            pagelet = queryPagelet(context, request, name)
-            if pagelet is not None:
-                return pagelet.updateAndRender()
-        except Exception, err:
-            log = logging.getLogger('zojax.layout')
-            log.exception(err)
+            try:
+                pagelet = queryGathered(request, context, name)
+                if pagelet is not None:
+                    pass
+                elif timer is None:
+                    pagelet = queryPagelet(context, request, name)
+                else:
+                    t = time.time()
+                    pagelet = queryPagelet(context, request, name)
+                    timer.pending = time.time() - t
+
+                if pagelet is not None:
+                    # edge cache loads pagelet separately
+                    if getattr(pagelet, 'esi', False) and esiEnabled(request):
+                        return esiInclude(context, request, name)
+
+                    # browser loads pagelet after page
+                    if isDeferred(pagelet, request):
+                        return deferPlaceholder(context, request, name)
+
+                    result = pagelet.updateAndRender()
+                    if getattr(pagelet, 'memoize', False):
+                        setMemoized(request, name, (pagelet.context,) +
+                                    tuple(pagelet.contexts), result)
+                    return result
+            except Exception, err:
+                log = logging.getLogger('zojax.layout')
+                log.exception(err)
+        finally:
+            # lookup time is used by span of this pagelet only, esi,
+            # deferred and memoized pagelets are rendered without span
+            if timer is not None:
+                timer.pending = 0.0
 
         return u''
 
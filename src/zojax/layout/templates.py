@@ -0,0 +1,214 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" templates of layout and pagelet directives
+
+$Id$
+"""
+import os, logging, tempfile, threading
+from multiprocessing.pool import ThreadPool
+from chameleon.core.filecache import TemplateRegistry
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+def getVersions(*names):
+    """ versions of distributions, compiled code depends on
+    chameleon and on translators of z3c.pt and zojax.layout """
+    import pkg_resources
+
+    versions = []
+    for name in names:
+        try:
+            versions.append(pkg_resources.get_distribution(name).version)
+        except Exception:
+            versions.append('')
+    return tuple(versions)
+
+compilerVersions = getVersions(
+    'chameleon.core', 'chameleon.zpt', 'z3c.pt', 'zojax.layout')
+
+# create template objects on first use
+lazy = os.environ.get(
+    'ZOJAX_LAYOUT_LAZY_TEMPLATES', '').lower() in ('1', 'on', 'true')
+
+# directory for compiled templates
+cachedir = os.environ.get('ZOJAX_LAYOUT_TEMPLATE_CACHE', '')
+
+_templates = []
+_lock = threading.Lock()
+
+
+class LazyTemplateFile(object):
+    """ template file, template object is created on first use """
+
+    def __init__(self, factory, filename, **kwargs):
+        self.factory = factory
+        self.filename = filename
+        self.kwargs = kwargs
+        self._template = None
+
+    def getTemplate(self):
+        if self._template is None:
+            _lock.acquire()
+            try:
+                if self._template is None:
+                    self._template = createTemplate(
+                        self.factory, self.filename, **self.kwargs)
+            finally:
+                _lock.release()
+
+        return self._template
+
+    def __get__(self, instance, type):
+        return self.getTemplate().__get__(instance, type)
+
+    def __call__(self, *args, **kw):
+        return self.getTemplate()(*args, **kw)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.getTemplate(), name)
+
+    def __repr__(self):
+        return '<%s %s>'%(self.__class__.__name__, self.filename)
+
+
+def templateFile(factory, filename, **kwargs):
+    """ create template for directive, template is added to
+    registry of templates """
+    if lazy:
+        template = LazyTemplateFile(factory, filename, **kwargs)
+    else:
+        template = createTemplate(factory, filename, **kwargs)
+
+    _templates.append(template)
+    return template
+
+
+def createTemplate(factory, filename, **kwargs):
+    template = factory(filename, **kwargs)
+    if cachedir:
+        template.registry = DiskTemplateRegistry(template, cachedir)
+    return template
+
+
+class DiskTemplateRegistry(TemplateRegistry):
+    """ registry of compiled template code, code is stored in directory
+    shared between processes. File name is hash of template source,
+    template class and versions of chameleon, z3c.pt and zojax.layout,
+    so cache doesn't need invalidation """
+
+    def __init__(self, template, directory):
+        TemplateRegistry.__init__(self)
+        self.template = template
+        self.directory = directory
+
+    def getFilename(self, key):
+        versions = [base.__dict__.get('version')
+                    for base in type(self.template).__mro__]
+
+        digest = sha1(repr(
+            (key, self.template.body, type(self.template).__name__,
+             versions, compilerVersions))).hexdigest()
+        return os.path.join(self.directory, '%s.py'%digest)
+
+    def __contains__(self, key):
+        if self.registry.get(key) is not None:
+            return True
+
+        try:
+            source = open(self.getFilename(key), 'rb').read()
+        except IOError:
+            return False
+
+        try:
+            TemplateRegistry.add(self, key, source)
+        except Exception:
+            logging.getLogger('zojax.layout').exception(
+                "Can't load compiled template: %s", self.template.filename)
+            return False
+
+        return True
+
+    def add(self, key, source):
+        TemplateRegistry.add(self, key, source)
+
+        # write to temporary file and rename, so other processes
+        # never read partially written file
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            try:
+                os.write(fd, source)
+            finally:
+                os.close(fd)
+            os.rename(tmp, self.getFilename(key))
+        except (IOError, OSError):
+            logging.getLogger('zojax.layout').warning(
+                "Can't store compiled template: %s", self.template.filename)
+
+
+def getTemplates():
+    return list(_templates)
+
+
+def compileTemplate(template):
+    """ compile template without rendering """
+    if isinstance(template, LazyTemplateFile):
+        template = template.getTemplate()
+
+    key = None, True, template.signature
+    if key not in template.registry:
+        template.registry.add(key, template.compiler(None, True))
+
+
+def precompile(workers=4):
+    """ compile all registered templates, returns number of templates
+    that can't be compiled """
+    def compile(template):
+        try:
+            compileTemplate(template)
+        except Exception, err:
+            logging.getLogger('zojax.layout').exception(
+                "Can't compile template: %s", template.filename)
+            return 1
+        return 0
+
+    templates = getTemplates()
+    if not templates:
+        return 0
+
+    pool = ThreadPool(max(min(workers, len(templates)), 1))
+    try:
+        return sum(pool.map(compile, templates))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def clear():
+    del _templates[:]
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(clear)
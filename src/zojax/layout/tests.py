@@ -22,7 +22,7 @@ from zope.app.testing import setup
 from zope.app.container.sample import SampleContainer
 from z3c.pt import expressions
 
-from zojax.layout import pagelet
+from zojax.layout import pagelet, result
 
 
 class IFolder1(interface.Interface):
@@ -54,6 +54,7 @@ def setUp(test):
     component.provideAdapter(pagelet.queryDefaultView)
     component.provideAdapter(pagelet.PageletPublisher, name='pagelet')
     component.provideAdapter(pagelet.PageletObjectPublisher,name='pageletObject')
+    component.provideAdapter(result.fragmentsResult)
     component.provideUtility(expressions.path_translator, name='path')
 
     setup.setUpTestAsModule(test, 'zojax.layout.TESTS')
@@ -81,4 +82,9 @@ def test_suite():
             setUp=setUp, tearDown=tearDown,
             optionflags=doctest.NORMALIZE_WHITESPACE|doctest.ELLIPSIS,
             ),
+        doctest.DocFileSuite(
+            'benchmark.txt',
+            setUp=setUp, tearDown=tearDown,
+            optionflags=doctest.NORMALIZE_WHITESPACE|doctest.ELLIPSIS,
+            ),
         ))
@@ -0,0 +1,220 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" per request render timing of views, layouts and pagelets
+
+$Id$
+"""
+import time, logging, threading
+from zope import interface, event
+
+from interfaces import IRenderTimingEvent
+from pageletcache import renderCached
+
+ANNOTATION_KEY = 'zojax.layout.timing'
+
+# timing is disabled by default
+enabled = False
+
+# set 'Server-Timing' response header
+header = False
+
+# log spans tree
+log = False
+
+_time = time.time
+
+
+def enable(serverTiming=True, logSpans=True):
+    global enabled, header, log
+    enabled = True
+    header = serverTiming
+    log = logSpans
+
+
+def disable():
+    global enabled, header, log
+    enabled = header = log = False
+
+
+class Span(object):
+    """ render span """
+
+    def __init__(self, kind, name, uid=u''):
+        self.kind = kind
+        self.name = name
+        self.uid = uid
+        self.start = _time()
+        self.duration = 0.0
+        self.lookup = 0.0
+        self.update = 0.0
+        self.render = 0.0
+        self.size = 0
+        self.children = []
+
+
+class RenderTimer(object):
+    """ tree of render spans of one request """
+
+    def __init__(self, request):
+        self.request = request
+        self.root = Span('request', request.get('PATH_INFO', u''))
+        self._local = threading.local()
+
+    @property
+    def stack(self):
+        # pagelets can be rendered in prefetch worker threads
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = [self.root]
+        return stack
+
+    def _getPending(self):
+        return getattr(self._local, 'pending', 0.0)
+
+    def _setPending(self, value):
+        self._local.pending = value
+
+    pending = property(_getPending, _setPending)
+
+    def start(self, kind, name, uid=u''):
+        span = Span(kind, name, uid)
+        self.stack[-1].children.append(span)
+        self.stack.append(span)
+        return span
+
+    def stop(self, span, result=None):
+        span.duration = _time() - span.start
+        if isinstance(result, basestring):
+            span.size = len(result)
+
+        stack = self.stack
+        while len(stack) > 1:
+            if stack.pop() is span:
+                break
+
+    def updateAndRender(self, pagelet):
+        span = self.start('pagelet', pagelet.__name__)
+        span.lookup, self.pending = self.pending, 0.0
+
+        result = u''
+        try:
+            if pagelet.cache is not None:
+                result = renderCached(
+                    pagelet, lambda pagelet: self._updateAndRender(pagelet,span))
+            else:
+                result = self._updateAndRender(pagelet, span)
+        finally:
+            self.stop(span, result)
+
+        return result
+
+    def _updateAndRender(self, pagelet, span):
+        t = _time()
+        pagelet.update()
+        span.update = _time() - t
+
+        if pagelet.isRedirected or not pagelet.isAvailable():
+            return u''
+
+        t = _time()
+        try:
+            return pagelet.render()
+        finally:
+            span.render = _time() - t
+
+    def spans(self, span=None, level=0):
+        if span is None:
+            span = self.root
+
+        for child in span.children:
+            yield level, child
+            for info in self.spans(child, level+1):
+                yield info
+
+    def totals(self):
+        totals = {'lookup': 0.0, 'update': 0.0, 'render': 0.0, 'total': 0.0}
+        for level, span in self.spans():
+            totals['lookup'] += span.lookup
+            totals['update'] += span.update
+            if level == 0:
+                totals['render'] += span.render
+                totals['total'] += span.duration
+        return totals
+
+    def serverTiming(self):
+        totals = self.totals()
+        return ', '.join(['%s;dur=%.1f'%(name, totals[name]*1000)
+                          for name in ('lookup', 'update', 'render', 'total')])
+
+    def format(self):
+        lines = ["%s '%s'"%(self.root.kind, self.root.name)]
+        for level, span in self.spans():
+            name = span.name or u''
+            if span.uid:
+                name = '%s (%s)'%(name, span.uid)
+
+            line = "%s%s '%s': lookup=%.1fms update=%.1fms"%(
+                '  '*(level+1), span.kind, name,
+                span.lookup*1000, span.update*1000)
+            if span.kind != 'layout':
+                line = '%s render=%.1fms size=%s'%(
+                    line, span.render*1000, span.size)
+            lines.append('%s total=%.1fms'%(line, span.duration*1000))
+        return '\n'.join(lines)
+
+    def finish(self):
+        """ top level view is rendered """
+        if len(self.stack) > 1:
+            return
+
+        if header:
+            self.request.response.setHeader(
+                'Server-Timing', self.serverTiming())
+
+        if log:
+            logging.getLogger('zojax.layout.timing').info(self.format())
+
+        event.notify(RenderTimingEvent(self.request, self))
+
+
+class RenderTimingEvent(object):
+    interface.implements(IRenderTimingEvent)
+
+    def __init__(self, request, timer):
+        self.request = request
+        self.timer = timer
+
+
+def queryTimer(request):
+    """ render timer of request, None if timing is disabled """
+    if not enabled:
+        return None
+
+    annotations = getattr(request, 'annotations', None)
+    if annotations is None:
+        return None
+
+    timer = annotations.get(ANNOTATION_KEY)
+    if timer is None:
+        timer = RenderTimer(request)
+        annotations[ANNOTATION_KEY] = timer
+    return timer
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(disable)
@@ -0,0 +1,69 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" user agent filter
+
+$Id$
+"""
+import re
+from zope import interface
+from zope.component import queryUtility
+
+from cache import LRUCache
+from interfaces import IUserAgentFilter
+
+# see ticket #415 - workaround for opening links from MS Office products
+OFFICE_PATTERNS = (r'[^\w](Word|Excel|PowerPoint|ms-office)([^\w]|\Z)',)
+
+
+class UserAgentFilter(object):
+    """ answer requests of matching user agents with empty page """
+    interface.implements(IUserAgentFilter)
+
+    def __init__(self, patterns=OFFICE_PATTERNS,
+                 status=None, headers=None, cachesize=1000):
+        self.patterns = tuple(patterns)
+        self.status = status
+        self.headers = dict(headers or {})
+
+        self._matcher = re.compile(
+            '|'.join(['(?:%s)'%pattern for pattern in self.patterns]), re.I)
+        self._cache = LRUCache(cachesize)
+
+    def match(self, ua):
+        result = self._cache.get(ua)
+        if result is None:
+            result = self._matcher.search(ua) is not None
+            self._cache[ua] = result
+        return result
+
+    def __call__(self, request):
+        ua = request.get('HTTP_USER_AGENT')
+        if not ua or not self.match(ua):
+            return False
+
+        response = request.response
+        if self.status:
+            response.setStatus(self.status)
+        for name, value in self.headers.items():
+            response.setHeader(name, value)
+        return True
+
+
+officeFilter = UserAgentFilter()
+
+
+def filterRequest(request):
+    """ check request with IUserAgentFilter utility,
+    MS Office filter is used by default """
+    return queryUtility(IUserAgentFilter, default=officeFilter)(request)
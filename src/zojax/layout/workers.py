@@ -0,0 +1,183 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" worker threads pool of prefetch and asynchronous updates
+
+Site and security interaction are propagated to worker threads.
+Workers can't be stopped, result of cancelled call is discarded,
+running worker of cancelled call is counted as late.
+
+$Id$
+"""
+import threading
+from multiprocessing.pool import ThreadPool, TimeoutError
+
+from zope.security.management import thread_local, queryInteraction
+from zope.app.component.hooks import getSite, setSite
+
+# size of worker threads pool
+poolsize = 8
+
+_pool = None
+_lock = threading.Lock()
+
+# workers that still run after their calls are cancelled
+_late = 0
+
+
+class Future(object):
+    """ result of asynchronous call """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+        self._started = False
+        self._cancelled = False
+
+    def done(self):
+        return self._event.isSet()
+
+    def set_result(self, value):
+        self._set(value, None)
+
+    def set_exception(self, error):
+        self._set(None, error)
+
+    def _set(self, value, error):
+        global _late
+
+        _lock.acquire()
+        try:
+            if self._event.isSet():
+                if self._cancelled and self._started:
+                    self._started = False
+                    _late -= 1
+                return
+
+            self._value = value
+            self._error = error
+            self._event.set()
+        finally:
+            _lock.release()
+
+    def _start(self):
+        _lock.acquire()
+        try:
+            if self._cancelled:
+                return False
+            self._started = True
+            return True
+        finally:
+            _lock.release()
+
+    def cancel(self):
+        """ future that is not done fails with TimeoutError """
+        global _late
+
+        _lock.acquire()
+        try:
+            if self._event.isSet():
+                return False
+
+            self._cancelled = True
+            if self._started:
+                _late += 1
+            self._error = TimeoutError('Future is cancelled')
+            self._event.set()
+            return True
+        finally:
+            _lock.release()
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+        return self.done()
+
+    def result(self, timeout=None):
+        if not self.wait(timeout):
+            raise TimeoutError()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+def getPool():
+    global _pool
+
+    if _pool is None:
+        _lock.acquire()
+        try:
+            if _pool is None:
+                _pool = ThreadPool(poolsize)
+        finally:
+            _lock.release()
+
+    return _pool
+
+
+def isBusy():
+    """ all workers are late """
+    return _late >= poolsize
+
+
+def submit(func, *args, **kw):
+    """ call function in worker thread, returns future """
+    future = Future()
+    getPool().apply_async(
+        _run, (getSite(), queryInteraction(), future, func, args, kw))
+    return future
+
+
+def _run(site, interaction, future, func, args, kw):
+    if not future._start():
+        return
+
+    value = error = None
+    setSite(site)
+    if interaction is not None:
+        thread_local.interaction = interaction
+    try:
+        try:
+            value = func(*args, **kw)
+        except Exception, error:
+            pass
+    finally:
+        if interaction is not None:
+            del thread_local.interaction
+        setSite(None)
+
+        future._set(value, error)
+
+
+def shutdown():
+    global _pool, _late
+
+    _lock.acquire()
+    try:
+        pool, _pool = _pool, None
+    finally:
+        _lock.release()
+
+    # workers use lock when they are done
+    if pool is not None:
+        pool.close()
+        pool.join()
+    _late = 0
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(shutdown)
@@ -15,13 +15,14 @@
 
 $Id$
 """
-import os.path
+import time, os.path
 from zope import schema, interface, event
 from zope.interface.verify import verifyClass
+from zope.interface.interfaces import IInterface
 from zope.schema.interfaces import IFromUnicode
-from zope.component import getUtility, queryUtility
+from zope.component import getUtility, queryUtility, getSiteManager
 from zope.component.interface import provideInterface
-from zope.component.zcml import handler, adapter, utility
+from zope.component.zcml import handler, utility
 from zope.security.zcml import Permission
 from zope.security.checker import defineChecker, Checker, CheckerPublic
 from zope.configuration.fields import Path,Tokens,GlobalObject,GlobalInterface
@@ -37,8 +38,38 @@ from z3c.pt.pagetemplate import ViewPageTemplateFile
 from interfaces import IPagelet, IPageletType
 from interfaces import ILayout, ILayoutCreatedEvent
 
-from pagelet import BrowserPagelet
-from layout import Layout, LayoutTemplateFile
+import zcmlprofile
+from plan import layoutPlan
+from templates import templateFile
+from pagelet import PageletBase, BrowserPagelet
+from layout import LayoutBase, Layout, LayoutTemplateFile
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+
+# directive name -> [number of directives, handling time]
+timings = zcmlprofile.totals
+
+
+def timed(name):
+    """ collect handling time of directive """
+    def decorator(func):
+        def wrapper(_context, *args, **kw):
+            record = zcmlprofile.start(name, _context)
+
+            t = time.time()
+            try:
+                return func(_context, *args, **kw)
+            finally:
+                zcmlprofile.stop(name, record, time.time() - t)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
 
 
 class IPageletTypeDirective(interface.Interface):
@@ -108,6 +139,55 @@ class IPageletDirective(IBasicViewInformation):
         required = False,
         default = IDefaultBrowserLayer)
 
+    cache = Tokens(
+        title = u'Cache key',
+        description = u"Cache pagelet output. List of cache key components "\
+            "(IPageletCacheKey utilities names, for example 'context "\
+            "principal layer language') or pagelet attributes "\
+            "('attr:<name>').",
+        required = False,
+        value_type = schema.TextLine())
+
+    cachettl = schema.Int(
+        title = u'Cache time to live',
+        description = u'Time to live for cached output in seconds.',
+        required = False,
+        default = 0)
+
+    memoize = schema.Bool(
+        title = u'Memoize',
+        description = u'Pagelet is idempotent, it is rendered once per '\
+            'request for same contexts.',
+        required = False,
+        default = False)
+
+    threadsafe = schema.Bool(
+        title = u'Thread-safe',
+        description = u"Pagelet doesn't use persistent data and can be "\
+            "prefetched by layout in worker thread.",
+        required = False,
+        default = False)
+
+    esi = schema.Bool(
+        title = u'Edge side include',
+        description = u"'pagelet:' expression renders ESI placeholder "\
+            "if request is sent by edge cache with ESI support.",
+        required = False,
+        default = False)
+
+    defer = schema.Bool(
+        title = u'Deferred',
+        description = u"'pagelet:' expression renders placeholder, browser "\
+            "loads all deferred pagelets of page with one request.",
+        required = False,
+        default = False)
+
+    cachecontrol = schema.TextLine(
+        title = u'Cache-Control',
+        description = u'Cache-Control header of pagelet loaded '\
+            'from @@pagelet view, for example by edge cache.',
+        required = False)
+
 
 # Arbitrary keys and values are allowed to be passed to the pagelet.
 IPageletDirective.setTaggedValue('keyword_arguments', True)
@@ -186,10 +266,54 @@ class ILayoutDirective(interface.Interface):
         title = u'Layout description',
         required = False)
 
+    cache = Tokens(
+        title = u'Cache key',
+        description = u"Cache static part of layout (layouts that support "\
+            "it, for example default portal layout). List of cache key "\
+            "components, same as for pagelet directive.",
+        required = False,
+        value_type = schema.TextLine())
+
+    cachettl = schema.Int(
+        title = u'Cache time to live',
+        description = u'Time to live for cached output in seconds.',
+        required = False,
+        default = 0)
+
+    prefetch = Tokens(
+        title = u'Prefetch pagelets',
+        description = u"Pagelets used by layout template with 'pagelet:' "\
+            "expression, they are updated and rendered in parallel "\
+            "before layout template is rendered.",
+        required = False,
+        value_type = schema.TextLine())
+
+    prefetchtimeout = schema.Float(
+        title = u'Prefetch timeout',
+        description = u'Time in seconds to wait for prefetched pagelets, '\
+            'pagelet output is empty on timeout.',
+        required = False,
+        default = 5.0)
+
+    gather = Tokens(
+        title = u'Gather pagelets',
+        description = u"Pagelets used by layout template with 'pagelet:' "\
+            "expression, their asynchronous updates ('updateAsync' method) "\
+            "are started before layouts are rendered.",
+        required = False,
+        value_type = schema.TextLine())
+
+    gathertimeout = schema.Float(
+        title = u'Gather timeout',
+        description = u'Time in seconds to wait for asynchronous updates.',
+        required = False,
+        default = 5.0)
+
 # Arbitrary keys and values are allowed
 ILayoutDirective.setTaggedValue('keyword_arguments', True)
 
 
+@timed('pageletType')
 def pageletTypeDirective(_context, name, interface):
     if interface is not IPagelet and interface.isOrExtends(IPublishTraverse):
         raise ConfigurationError("Can't use IPublishTraverse as base for pagelet type")
@@ -197,11 +321,14 @@ def pageletTypeDirective(_context, name, interface):
     provideInterface(name, interface, IPageletType)
 
 
+@timed('layout')
 def layoutDirective(
     _context, uid='', template='', for_=None, view=None, name = u'',
     layer = IDefaultBrowserLayer, provides = ILayout,
     contentType='text/html', class_ = None, layout = '',
-    title='', description='', **kwargs):
+    title='', description='', cache=None, cachettl=0,
+    prefetch=None, prefetchtimeout=5.0, gather=None, gathertimeout=5.0,
+    **kwargs):
 
     if not layout:
         layout = None
@@ -210,24 +337,103 @@ def layoutDirective(
 
     # Make sure that the template exists
     if template:
+        t = time.time()
         template = os.path.abspath(str(_context.path(template)))
         if not os.path.isfile(template):
             raise ConfigurationError("No such file", template)
+        zcmlprofile.add('template', time.time() - t)
 
     # Check
     if (for_ is None) and (view is None):
         raise ConfigurationError("FOR or VIEW are required.")
 
+    if gather:
+        kwargs['gather'] = tuple(gather)
+        kwargs['gathertimeout'] = gathertimeout
+
+    # registrations that differ only by 'for', 'view' or 'layer' share
+    # generated class and security checker
+    key = None
+    if cache is None and not uid:
+        args = ('layout', name, layout, title, description, prefetch,
+                prefetchtimeout, template, contentType, class_, provides,
+                kwargs)
+        key = _sharedKey(*args)
+
+    shared = _getShared(_context)
+    if key in shared:
+        item = shared[key]
+        item[2] += 1
+        newclass = item[0]
+        zcmlprofile.add('shared')
+    else:
+        newclass = _createLayoutClass(
+            _context, uid, template, for_, view, name, layer, provides,
+            contentType, class_, layout, title, description, cache,
+            cachettl, prefetch, prefetchtimeout, kwargs)
+        if key is not None:
+            shared[key] = [newclass, args, 0]
+
+    # register the template
+    required = (view, for_, layer)
+    _context.action(
+        discriminator = ('adapter', required, provides, name),
+        callable = handler,
+        args = ('registerAdapter',
+                newclass, required, provides, name, _context.info))
+    _provideInterface(_context, '', provides)
+    _handle_for(_context, required)
+    zcmlprofile.add('adapters')
+
+    # layout plan
+    _context.action(
+        discriminator = ('zojax.layout:plan', view, for_, layer, provides, name),
+        callable = layoutPlan.add,
+        args = ((view, for_, layer, provides, name),
+                name, layout, view, for_, layer, newclass))
+
+    _context.action(
+        discriminator = None,
+        callable = layoutPlan.compile,
+        order = 99999999)
+
+    # send ILayoutCreatedEvent event
+    if uid:
+        _context.action(
+            discriminator = ('zojax.layout', uid),
+            callable = sendNotification,
+            args = (uid, name, view, for_, layer, newclass, kwargs),
+            order = 99999999)
+
+
+def _createLayoutClass(
+    _context, uid, template, for_, view, name, layer, provides,
+    contentType, class_, layout, title, description, cache,
+    cachettl, prefetch, prefetchtimeout, kwargs):
     # Build a new class that we can use different permission settings if we
     # use the class more then once.
     cdict = {}
     cdict['__name__'] = name
+    cdict['uid'] = uid
     cdict['layout'] = layout
     cdict['title'] = title
     cdict['description'] = description
 
+    if cache is not None:
+        cdict['cache'] = tuple(cache)
+        cdict['cachettl'] = cachettl
+        cdict['cacheid'] = md5(repr(
+            (str(_context.info), uid, name, view, for_, layer))).hexdigest()
+
+    if prefetch:
+        cdict['prefetch'] = tuple(prefetch)
+        cdict['prefetchtimeout'] = prefetchtimeout
+
     if template:
-        cdict['template'] = LayoutTemplateFile(template,content_type=contentType)
+        t = time.time()
+        cdict['template'] = templateFile(
+            LayoutTemplateFile, template, content_type=contentType)
+        zcmlprofile.add('template', time.time() - t)
 
     cdict.update(kwargs)
 
@@ -235,10 +441,16 @@ def layoutDirective(
 
     if class_ is None:
         bases = (Layout,)
+    elif issubclass(class_, LayoutBase):
+        bases = (class_,)
     else:
         bases = (class_, Layout)
 
+    if _isCompact(bases):
+        cdict['__slots__'] = ()
+
     newclass = type(str(class_name), bases, cdict)
+    zcmlprofile.add('classes')
 
     # Set up permission mapping for various accessible attributes
     required = {}
@@ -257,22 +469,9 @@ def layoutDirective(
 
     # security checker
     defineChecker(newclass, Checker(required))
+    zcmlprofile.add('checkers')
 
-    # register the template
-    if name:
-        adapter(_context, (newclass,),
-                provides, (view, for_, layer), name=name)
-    else:
-        adapter(_context, (newclass,),
-                provides, (view, for_, layer))
-
-    # send ILayoutCreatedEvent event
-    if uid:
-        _context.action(
-            discriminator = ('zojax.layout', uid),
-            callable = sendNotification,
-            args = (uid, name, view, for_, layer, newclass, kwargs),
-            order = 99999999)
+    return newclass
 
 
 class LayoutCreatedEvent(object):
@@ -297,11 +496,14 @@ def sendNotification(uid, name, view, context, layer, layoutclass, keywords):
 Type = type
 
 # pagelet directive
+@timed('pagelet')
 def pageletDirective(
     _context, for_, name=u'', type=(),
     class_=None, layer=IDefaultBrowserLayer, provides=[],
     allowed_interface=[], allowed_attributes=[],
-    template=u'', layout=u'', permission='zope.Public', **kwargs):
+    template=u'', layout=u'', permission='zope.Public',
+    cache=None, cachettl=0, memoize=False, threadsafe=False, esi=False,
+    defer=False, cachecontrol=None, **kwargs):
 
     # Check paeglet name
     if not name and not type:
@@ -312,15 +514,83 @@ def pageletDirective(
     if IPagelet not in provides:
         provides.append(IPagelet)
 
-    # Security map dictionary
-    required = {}
-
     # Make sure that the template exists
     if template:
         template = os.path.abspath(str(_context.path(template)))
         if not os.path.isfile(template):
             raise ConfigurationError("No such file", template)
-        kwargs['template'] = ViewPageTemplateFile(template)
+
+    allowed_interface = list(allowed_interface)
+    allowed_attributes = list(allowed_attributes)
+
+    if memoize:
+        kwargs['memoize'] = True
+    if threadsafe:
+        kwargs['threadsafe'] = True
+    if esi:
+        kwargs['esi'] = True
+    if defer:
+        kwargs['defer'] = True
+    if cachecontrol:
+        kwargs['cachecontrol'] = str(cachecontrol)
+
+    # registrations that differ only by 'for' or 'layer' share
+    # generated class and security checker
+    key = None
+    if cache is None:
+        args = ('pagelet', name, type, class_, provides, allowed_interface,
+                allowed_attributes, template, layout, permission, kwargs)
+        key = _sharedKey(*args)
+
+    shared = _getShared(_context)
+    if key in shared:
+        item = shared[key]
+        item[2] += 1
+        new_class, provides, tps = item[0]
+        zcmlprofile.add('shared')
+    else:
+        new_class, provides, tps = _createPageletClass(
+            _context, for_, name, type, class_, layer, provides,
+            allowed_interface, allowed_attributes, template, layout,
+            permission, cache, cachettl, kwargs)
+        if key is not None:
+            shared[key] = [(new_class, provides, tps), args, 0]
+
+    # Register the interfaces.
+    _handle_for(_context, for_)
+
+    # register pagelet
+    for_.append(layer)
+    if type:
+        zcmlprofile.add('adapters', len(tps))
+        _context.action(
+            discriminator = (
+                'zojax.layout:registerPagelets',
+                tuple(type), tuple(for_), layer, name),
+            callable = registerTypedPagelets,
+            args = (for_, new_class, tps, name, _context))
+    else:
+        zcmlprofile.add('adapters', 1 + len(
+            [iface for iface in provides if iface is not IPagelet
+             and IPageletType.providedBy(iface)]))
+        _context.action(
+            discriminator = (
+                'zojax.layout:registerPagelets', tuple(for_), layer, name),
+            callable = registerPagelets,
+            args = (for_, new_class, provides, name, _context.info))
+
+
+def _createPageletClass(
+    _context, for_, name, type, class_, layer, provides,
+    allowed_interface, allowed_attributes, template, layout,
+    permission, cache, cachettl, kwargs):
+    # Security map dictionary
+    required = {}
+
+    if template:
+        t = time.time()
+        kwargs['template'] = templateFile(ViewPageTemplateFile, template)
+        zcmlprofile.add('template', time.time() - t)
 
     # Build a new class that we can use different permission settings if we
     # use the class more then once.
@@ -329,15 +599,25 @@ def pageletDirective(
     cdict['__name__'] = name
     cdict['layoutname'] = layout
 
+    if cache is not None:
+        cdict['cache'] = tuple(cache)
+        cdict['cachettl'] = cachettl
+        cdict['cacheid'] = md5(repr(
+            (str(_context.info), name, type, for_, layer))).hexdigest()
+
     if class_ is not None:
-        if issubclass(class_, BrowserPagelet):
+        if issubclass(class_, PageletBase):
             bases = (class_,)
         else:
             bases = (class_, BrowserPagelet)
     else:
         bases = (BrowserPagelet,)
 
+    if _isCompact(bases):
+        cdict['__slots__'] = ()
+
     new_class = Type('PageletClass from %s'%class_, bases, cdict)
+    zcmlprofile.add('classes')
 
     # extend provides with type
     tps = []
@@ -351,6 +631,7 @@ def pageletDirective(
 
         if iface is not None:
             provides.append(iface)
+        tps.append((tp, iface))
 
     kwargs['type'] = type
     kwargs['name'] = name
@@ -358,9 +639,9 @@ def pageletDirective(
 
     # convert kwargs
     for iface in provides:
-        for fname, field in schema.getFields(iface).items():
+        for fname, field, convertable in _getFields(iface):
             if fname in kwargs:
-                if not IFromUnicode.providedBy(field):
+                if not convertable:
                     raise ConfigurationError("Can't convert value", fname)
 
                 setattr(new_class, fname, field.fromUnicode(kwargs[fname]))
@@ -397,34 +678,21 @@ def pageletDirective(
     _handle_allowed_attributes(
         _context, allowed_attributes, permission, required)
 
-    # Register the interfaces.
-    _handle_for(_context, for_)
-
-    # provide the custom provides interface if not allready provided
+    # provide the custom provides interface if not allready provided,
+    # class is verified only in development mode
+    verify = _context.hasFeature('devmode')
     for iface in provides:
         if not iface.implementedBy(new_class):
             interface.classImplements(new_class, iface)
 
-        verifyClass(iface, new_class)
+        if verify:
+            verifyClass(iface, new_class)
 
     # Create the security checker for the new class
     defineChecker(new_class, Checker(required))
+    zcmlprofile.add('checkers')
 
-    # register pagelet
-    for_.append(layer)
-    if type:
-        _context.action(
-            discriminator = (
-                'zojax.layout:registerPagelets',
-                tuple(type), tuple(for_), layer, name),
-            callable = registerTypedPagelets,
-            args = (for_, new_class, type, name, _context))
-    else:
-        _context.action(
-            discriminator = (
-                'zojax.layout:registerPagelets', tuple(for_), layer, name),
-            callable = registerPagelets,
-            args = (for_, new_class, provides, name, _context.info))
+    return new_class, provides, tps
 
 
 def registerPagelets(required, newClass, provides, name, info):
@@ -439,8 +707,11 @@ def registerPagelets(required, newClass, provides, name, info):
 
 
 def registerTypedPagelets(required, newClass, type, name, _context):
-    for tp in type:
-        iface = queryUtility(IPageletType, tp)
+    # pagelet types are resolved during directive handling,
+    # types that are not resolved yet are resolved again
+    for tp, iface in type:
+        if iface is None:
+            iface = queryUtility(IPageletType, tp)
         if iface is None:
             try:
                 iface = _context.resolve(tp)
@@ -450,15 +721,98 @@ def registerTypedPagelets(required, newClass, type, name, _context):
         handler('registerAdapter', newClass, required, iface,name,_context.info)
 
 
+_fields = {}
+
+def _getFields(iface):
+    """ fields of interface and whether value can be converted
+    from unicode, interfaces are not changed after creation so result
+    is cached """
+    # interfaces are compared by name, so cache is keyed by identity
+    item = _fields.get(id(iface))
+    if item is None or item[0] is not iface:
+        item = (iface, [(fname, field, IFromUnicode.providedBy(field))
+                        for fname, field in schema.getFields(iface).items()])
+        _fields[id(iface)] = item
+    return item[1]
+
+
+def _isCompact(bases):
+    # generated class keeps compact layout of slot based bases
+    for base in bases:
+        if base.__dictoffset__:
+            return False
+    return True
+
+
+def _getRoot(_context):
+    # configuration machine, data is stored per configuration
+    while getattr(_context, 'context', None) is not None:
+        _context = _context.context
+    return _context
+
+
+def _getShared(_context):
+    """ generated classes shared by identical registrations """
+    return _getRoot(_context).__dict__.setdefault('_zojax_layout_shared', {})
+
+
+def _sharedKey(*args):
+    # interfaces and classes are compared by identity, shared items
+    # reference original objects, so ids are not reused
+    key = []
+    for arg in args:
+        if arg is None or isinstance(arg, (basestring, int, float)):
+            key.append(arg)
+        elif isinstance(arg, (list, tuple)):
+            key.append(_sharedKey(*arg))
+        elif isinstance(arg, dict):
+            key.append(_sharedKey(*sorted(arg.items())))
+        else:
+            key.append(('id', id(arg)))
+    return tuple(key)
+
+
+def sharedClasses(_context):
+    """ number of saved classes per directive """
+    result = {}
+    for key, item in _getShared(_context).items():
+        result[key[0]] = result.get(key[0], 0) + item[2]
+    return result
+
+
+def _provideInterface(_context, id, iface):
+    # provideInterface action is emitted once per configuration
+    root = _getRoot(_context)
+
+    provided = root.__dict__.setdefault('_zojax_layout_interfaces', {})
+    item = provided.get((id, iface))
+    if item is iface:
+        return
+    provided[(id, iface)] = iface
+
+    _context.action(
+        discriminator = None,
+        callable = _registerInterface,
+        args = (id, iface))
+
+
+def _registerInterface(id, iface):
+    # same as provideInterface, but interface is registered in
+    # current site manager, like other components
+    if not IInterface.providedBy(iface):
+        return
+
+    if not id:
+        id = '%s.%s'%(iface.__module__, iface.__name__)
+    getSiteManager().registerUtility(iface, IInterface, id)
+
+
 def _handle_allowed_interface(
     _context, allowed_interface, permission, required):
     # Allow access for all names defined by named interfaces
     if allowed_interface:
         for i in allowed_interface:
-            _context.action(
-                discriminator = None,
-                callable = provideInterface,
-                args = (None, i))
+            _provideInterface(_context, None, i)
 
             for name in i:
                 required[name] = permission
@@ -474,7 +828,4 @@ def _handle_allowed_attributes(
 def _handle_for(_context, for_):
     for iface in for_:
         if iface is not None:
-            _context.action(
-                discriminator = None,
-                callable = provideInterface,
-                args = ('', iface))
+            _provideInterface(_context, '', iface)
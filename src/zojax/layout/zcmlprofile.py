@@ -0,0 +1,193 @@
+##############################################################################
+#
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" profiling of zojax:layout, zojax:pagelet and zojax:pageletType directives
+
+$Id$
+"""
+import os, logging
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+# profiling is enabled with ZOJAX_LAYOUT_PROFILE environment variable,
+# value is path of json report or 'on' for text report only
+output = os.environ.get('ZOJAX_LAYOUT_PROFILE', '')
+enabled = bool(output)
+
+COUNTERS = ('template', 'classes', 'shared', 'checkers', 'adapters')
+
+records = []
+_current = None
+
+# directive name -> [number of directives, handling time],
+# totals are collected even if profiling is disabled
+totals = {}
+
+
+class DirectiveRecord(object):
+
+    def __init__(self, directive, info):
+        self.directive = directive
+        self.info = info
+        self.time = 0.0
+        self.template = 0.0
+        self.classes = 0
+        self.shared = 0
+        self.checkers = 0
+        self.adapters = 0
+
+    @property
+    def filename(self):
+        return getattr(self.info, 'file', None) or str(self.info)
+
+    def asDict(self):
+        return {'directive': self.directive,
+                'file': self.filename,
+                'line': getattr(self.info, 'line', None),
+                'time': self.time,
+                'template': self.template,
+                'classes': self.classes,
+                'shared': self.shared,
+                'checkers': self.checkers,
+                'adapters': self.adapters}
+
+
+def start(directive, _context):
+    """ start record of directive, returns None if profiling is disabled """
+    global _current
+
+    if not enabled:
+        return None
+
+    _scheduleReport(_context)
+
+    _current = DirectiveRecord(directive, getattr(_context, 'info', None))
+    records.append(_current)
+    return _current
+
+
+def stop(directive, record, duration):
+    global _current
+
+    item = totals.setdefault(directive, [0, 0.0])
+    item[0] += 1
+    item[1] += duration
+
+    if record is not None:
+        record.time = duration
+        _current = None
+
+
+def add(name, value=1):
+    """ add value to counter of current directive """
+    if _current is not None:
+        setattr(_current, name, getattr(_current, name) + value)
+
+
+def _scheduleReport(_context):
+    # report is dumped once per configuration,
+    # after all actions are executed
+    from zcml import _getRoot  # zcml imports this module
+    root = _getRoot(_context)
+
+    if root.__dict__.get('_zojax_layout_profile'):
+        return
+    root.__dict__['_zojax_layout_profile'] = True
+
+    _context.action(
+        discriminator = None,
+        callable = dump,
+        order = 999999999)
+
+
+def summary(key='directive'):
+    """ totals grouped by directive name or by file,
+    sorted by time """
+    totals = {}
+    for record in records:
+        if key == 'file':
+            name = record.filename
+        else:
+            name = record.directive
+
+        item = totals.get(name)
+        if item is None:
+            item = totals[name] = {
+                'name': name, 'count': 0, 'time': 0.0, 'template': 0.0,
+                'classes': 0, 'shared': 0, 'checkers': 0, 'adapters': 0}
+
+        item['count'] += 1
+        item['time'] += record.time
+        for counter in COUNTERS:
+            item[counter] += getattr(record, counter)
+
+    result = totals.values()
+    result.sort(key=lambda item: item['time'], reverse=True)
+    return result
+
+
+def textReport(limit=20):
+    lines = []
+    for key in ('directive', 'file'):
+        lines.append('zojax.layout directives by %s:'%key)
+        for item in summary(key)[:limit]:
+            lines.append(
+                '  %(name)s: count=%(count)s time=%(time).3fs '
+                'template=%(template).3fs classes=%(classes)s '
+                'shared=%(shared)s checkers=%(checkers)s '
+                'adapters=%(adapters)s'%item)
+    return '\n'.join(lines)
+
+
+def jsonReport():
+    return json.dumps({
+        'directives': summary('directive'),
+        'files': summary('file'),
+        'records': [record.asDict() for record in records]}, indent=2)
+
+
+def dump():
+    if not records:
+        return
+
+    logging.getLogger('zojax.layout').info(textReport())
+
+    if output and output.lower() not in ('1', 'on', 'true'):
+        try:
+            f = open(output, 'w')
+            try:
+                f.write(jsonReport())
+            finally:
+                f.close()
+        except IOError:
+            logging.getLogger('zojax.layout').exception(
+                "Can't write profiling report: %s", output)
+
+
+def clear():
+    global _current
+
+    del records[:]
+    totals.clear()
+    _current = None
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(clear)